@@ -7,19 +7,35 @@ import numpy as np
 import sys
 import os
 import functools
+import time
 import logging
 from NardeLbl_designer import Ui_MainWindow as UiMain
 from display import Display
+from framebuffers import FrameBuffer
+from prefetch import ImagePrefetcher
+from diskcache import DecodedImageCache
+from imagesource import ImageSource
+from datasetindex import DatasetIndex, label_stem
+from filelist import FileListModel
+from dirscan import DirectoryScanner
+from labelwriter import LabelWriter
+from journal import EditJournal
+from stats import DatasetStats, StatsPanel
+from thumbs import ThumbnailAtlas, ThumbnailLoader, ThumbnailModel
 from sample import Sample
+from scheduler import DIRTY_BOXES
+from yolo import load_classes
+import logpipe
 
 
-logging.basicConfig(filename='nardelbl.log', level=logging.DEBUG)
+log = logpipe.get_logger('ui')
 
 
 class MainApp(qtw.QApplication):
 
     def __init__(self, argv):
         super().__init__(argv)
+        logpipe.setup_logging('nardelbl.log')
         self.mw = MainWindow()
         self.mw.show()
 
@@ -30,9 +46,6 @@ class MainWindow(qtw.QMainWindow):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.xlog_enabled = True
-        self.xlog_level = logging.getLogger().getEffectiveLevel()
-        self.xlog_quiet = False
         self.ui = UiMain()
         self.ui.setupUi(self)
 
@@ -47,20 +60,60 @@ class MainWindow(qtw.QMainWindow):
         self.sample :Sample = None
         self.selected_class = ''
         self.imgdir = ''
+        self.dataset :DatasetIndex = None
+        self.journal :EditJournal = None
+        self.image_cache = self._open_image_cache()
+        self.prefetcher = ImagePrefetcher(decode=self.image_cache.load if self.image_cache is not None else cv2.imread)
+        self.prefetch_radius = 2  # images decoded ahead on each side of the current one
+        self.label_writer = LabelWriter()
         self.colors = {
             'red'   :   (0, 0, 255), 
             'blue'  :   (255, 0, 0)
         }
         self.ui.cbox_box_color.addItems(self.colors.keys())
+        self.file_model = FileListModel()
+        self.ui.lstv_files.setModel(self.file_model)
+        self.ui.cbox_file_sort.addItems(FileListModel.SORT_KEYS)
+        self.stats = DatasetStats()
+        self.stats_panel = StatsPanel(self.stats, self)
+        self.addDockWidget(qtc.Qt.DockWidgetArea.RightDockWidgetArea, self.stats_panel)
+        self.stats_panel.hide()
+        view_menu = self.menuBar().addMenu('View')
+        view_menu.addAction(self.stats_panel.toggleViewAction())
+        self.act_frame_timings = view_menu.addAction('Frame Timings')
+        self.act_frame_timings.setCheckable(True)
+        self.act_export_timings = view_menu.addAction('Export Frame Timings...')
+        self.act_clear_image_cache = view_menu.addAction('Clear Image Cache')
+        self.act_clear_image_cache.setEnabled(self.image_cache is not None)
+        self.act_debug_logging = view_menu.addAction('Debug Logging')
+        self.act_debug_logging.setCheckable(True)
+        self.act_debug_logging.setChecked(logging.getLogger(logpipe.ROOT).isEnabledFor(logging.DEBUG))
+        self.lbl_frame_timings = qtw.QLabel(self)
+        self.lbl_frame_timings.hide()
+        self.ui.statusbar.addPermanentWidget(self.lbl_frame_timings)
+        self.frame_timings_timer = qtc.QTimer(self)
+        self.frame_timings_timer.setInterval(500)
+        self.thumb_loader = ThumbnailLoader()
+        self.thumb_model = ThumbnailModel(self.thumb_loader, lambda filei: self.files[filei])
+        self.thumb_model.setSourceModel(self.file_model)
+        self.ui.lstv_thumbs.setModel(self.thumb_model)
+        self.thumb_size = 96
+        self.ui.lstv_thumbs.setIconSize(qtc.QSize(self.thumb_size, self.thumb_size))
+        self.ui.lstv_thumbs.setGridSize(qtc.QSize(self.thumb_size + 16, self.thumb_size + 24))
+        self.ui.lstv_thumbs.hide()
 
         lbl = self.ui.lbl_display
         slider = self.ui.hsldr_scale
         hzsb = self.ui.hsb_display
         vtsb = self.ui.vsb_display
-        self.display = Display(lbl, slider, hzsb, vtsb)
+        self.display = Display(lbl, slider, hzsb, vtsb, loader=self.prefetcher.get)
         self.display_qthread = qtc.QThread()
         self.display.moveToThread(self.display_qthread)
         self.display_qthread.start()
+        self.scanner = DirectoryScanner()
+        self.scanner_qthread = qtc.QThread()
+        self.scanner.moveToThread(self.scanner_qthread)
+        self.scanner_qthread.start()
         self.connect_signals()
 
     def connect_signals(self):
@@ -68,20 +121,35 @@ class MainWindow(qtw.QMainWindow):
         self.display.sgl_msg.connect(self.on_sgl_msg)
         self.ui.btn_select_image_dir.clicked.connect(self.load_image_dir)
         self.ui.btn_select_class_file.clicked.connect(self.load_classes_file)
-        self.ui.btn_save.clicked.connect(self.save_annotations)
+        self.ui.btn_save.clicked.connect(self.on_save_clicked)
+        self.label_writer.sgl_written.connect(self.on_labels_written)
+        self.label_writer.sgl_failed.connect(self.on_labels_write_failed)
         self.sgl_update_src.connect(self.display.set_src_and_sample)
         self.display.sgl_did_display.connect(self.update_display_pixmap)
         self.display.sgl_bbox_updated.connect(self.update_sample_displays)
+        self.display.sgl_bbox_updated.connect(self.update_stats_from_sample)
         self.display.sgl_display_in_focus.connect(self.on_display_in_focus)
         self.display.sgl_display_out_focus.connect(self.on_display_out_focus)
         self.ui.cbox_class.currentIndexChanged.connect(self.on_class_changed)
         self.ui.btn_next_file.clicked.connect(self.load_next_image)
         self.ui.btn_prev_file.clicked.connect(self.load_prev_image)
-        self.ui.lstw_files.itemClicked.connect(self.load_clicked_image)
+        self.ui.lstv_files.clicked.connect(self.load_clicked_image)
+        self.ui.lstv_thumbs.clicked.connect(self.load_clicked_thumbnail)
+        self.ui.btn_grid_view.toggled.connect(self.on_grid_view_toggled)
+        self.act_frame_timings.toggled.connect(self.on_frame_timings_toggled)
+        self.act_export_timings.triggered.connect(self.export_frame_timings)
+        self.act_debug_logging.toggled.connect(logpipe.set_debug)
+        self.act_clear_image_cache.triggered.connect(self.clear_image_cache)
+        self.frame_timings_timer.timeout.connect(self.update_frame_timings)
+        self.ui.ledit_file_filter.textChanged.connect(self.on_file_filter_changed)
+        self.ui.cbox_file_sort.currentTextChanged.connect(self.on_file_sort_changed)
         self.ui.lstw_bboxes.itemClicked.connect(self.select_bbox_from_lstw)
         self.ui.cbox_box_color.currentIndexChanged.connect(self.change_box_color)
         self.sgl_select_box.connect(self.display.select_box)
         self.display.sgl_src_updated.connect(self.update_sample_displays)
+        self.scanner.sgl_batch.connect(self.on_scan_batch)
+        self.scanner.sgl_finished.connect(self.on_scan_finished)
+        self.scanner.sgl_added.connect(self.on_images_added)
 
     # --------------------------------------------------------------
     # Buttons
@@ -94,26 +162,93 @@ class MainWindow(qtw.QMainWindow):
         options |= qtw.QFileDialog.Option.ShowDirsOnly
         directory = qfd.getExistingDirectory(self, "Select Directory", options=options)
         if directory:
-            print("Selected Directory:", directory)
+            log.info('Selected directory %s', directory)
         else:
             return
+        if self.sample is not None:
+            self.save_annotations()
+        self.close_journal()
         self.imgdir = directory
         self.ui.ledit_image_dir.setText(directory)
-        files :list[str] = []
-        extensions = ['.png', '.bmp', '.jpeg', '.jpg']
-        for ext in extensions:
-            files.extend(glob.glob(os.path.join(directory, f'*{ext}')))
-        for file in files:
-            self.files.append(file)
-            i = file.rfind('\\')
-            filename = file[i+1:]
-            self.ui.lstw_files.addItem(filename)
-        if self.classes_file is None:
-            self.classes_file = self.search_for_classes_file(self.imgdir)
-            self._load_classes_file(self.classes_file)
-        self.load_image_and_annotations(files[0])
-        self._setCurrentRow_no_signal(self.ui.lstw_files, 0)
+        self.journal = EditJournal(directory)
+        stale = self.journal.stale_journals()
+        if stale:
+            self.xlog(f'Recovering unsaved edits from {len(stale)} journal(s).', logging.INFO)
+            self.journal.recover(self.label_writer)
+        if self.sample is not None:
+            # Still showing the old directory's image; the new journal takes over once its
+            # first image is loaded, so edits are never recorded against the wrong dataset.
+            self.sample.journal = None
+        # The scanner lists the directory on its own thread and closes the previous index.
+        self.dataset = DatasetIndex(directory)
+        self.files = []
+        self.filesi = 0
+        self.file_model.set_files([])
+        self.thumb_model.clear()
+        self.thumb_loader.set_atlas(ThumbnailAtlas(directory, self.thumb_size))
+        self.stats.reset()
+        self.scanner.scan(directory, self.dataset)
+
+    @qtc.pyqtSlot(str, list)
+    def on_scan_batch(self, directory: str, batch: list):
+        # batch: [(name, mtime_ns, boxes)] in the order os.scandir returned them.
+        if directory != self.imgdir:
+            return
+        self._add_files([name for name, _, _ in batch], [mtime for _, mtime, _ in batch], [boxes for _, _, boxes in batch])
+
+    @qtc.pyqtSlot(str, list)
+    def on_scan_finished(self, directory: str, rows: list):
+        if directory != self.imgdir:
+            return
+        self.xlog(f'Indexed {len(rows)} images ({self.dataset.updated} updated, {self.dataset.removed} removed).', logging.INFO)
+        # Box counts streamed with the batches came from the previous session's index.
+        boxes = {row[0]: row[6] for row in rows}
+        self.file_model.update_boxes([boxes.get(os.path.basename(path), 0) for path in self.files])
+        self.select_current_file_row()
+        self.stats.reset(len(rows))
+        self.stats.load(directory, rows)
+
+    @qtc.pyqtSlot(str, list)
+    def on_images_added(self, directory: str, rows: list):
+        if directory != self.imgdir:
+            return
+        self.xlog(f'{len(rows)} new images in {directory}', logging.INFO)
+        self._add_files([row[0] for row in rows], [row[2] for row in rows], [row[6] for row in rows])
+        self.stats.add_images(len(rows))
+        self.stats.load(directory, rows)
+
+    def _add_files(self, names: list[str], mtimes: list[int], boxes: list[int]):
+        first = len(self.files) == 0
+        self.files.extend(os.path.join(self.imgdir, name) for name in names)
+        self.file_model.add_files(names, mtimes, boxes)
+        if first and self.files:
+            # Open something as soon as the first batch is in rather than after the scan.
+            if self.classes_file is None:
+                self.classes_file = self.search_for_classes_file(self.imgdir)
+                self._load_classes_file(self.classes_file)
+            if self.file_model.rowCount() > 0:
+                self.filesi = self.file_model.file_index(0)
+            self.load_image_and_annotations(self.files[self.filesi])
+        self.select_current_file_row()
     
+    @staticmethod
+    def _open_image_cache():
+        # Decoded pixels of large images are kept on local disk between visits and sessions.
+        # Off unless NARDELBL_IMAGE_CACHE_MB sets a size limit (e.g. 4096).
+        limit_mb = int(os.environ.get('NARDELBL_IMAGE_CACHE_MB', 0))
+        if limit_mb <= 0:
+            return None
+        try:
+            return DecodedImageCache(os.environ.get('NARDELBL_IMAGE_CACHE_DIR'), limit_mb * 1024 * 1024)
+        except OSError as e:
+            log.warning('Decoded image cache disabled: %s', e)
+            return None
+
+    @qtc.pyqtSlot()
+    def clear_image_cache(self):
+        n = self.image_cache.clear()
+        self.xlog(f'Deleted {n} cached images from {self.image_cache.directory}', logging.INFO)
+
     def search_for_classes_file(self, dir):
         lst = glob.glob(os.path.join(dir, 'classes.txt'))
         if len(lst) == 0:
@@ -121,32 +256,60 @@ class MainWindow(qtw.QMainWindow):
         return lst[0]
 
     def load_next_image(self):
-        if len(self.files) == 0:
-            return
-        if self.filesi == len(self.files) - 1:
-            return
-        self.filesi = self.filesi + 1
-        self.save_annotations()
-        self.load_image_and_annotations(self.files[self.filesi])
-        self._setCurrentRow_no_signal(self.ui.lstw_files, self.filesi)
+        self._step_image(1)
 
     def load_prev_image(self):
+        self._step_image(-1)
+
+    def _step_image(self, delta: int):
+        # Next/previous follow the list as it is shown, i.e. sorted and filtered.
         if len(self.files) == 0:
             return
-        if self.filesi == 0:
+        filei = self.file_model.step(self.filesi, delta)
+        if filei is None:
             return
-        self.filesi = self.filesi - 1
         self.save_annotations()
+        self.filesi = filei
         self.load_image_and_annotations(self.files[self.filesi])
-        self._setCurrentRow_no_signal(self.ui.lstw_files, self.filesi)
+        self.select_current_file_row()
 
-    @qtc.pyqtSlot(qtw.QListWidgetItem)
-    def load_clicked_image(self, item: qtw.QListWidgetItem):
-        lstw = item.listWidget()
-        self.filesi = lstw.currentIndex().row()
+    @qtc.pyqtSlot(qtc.QModelIndex)
+    def load_clicked_image(self, index: qtc.QModelIndex):
+        filei = self.file_model.file_index(index.row())
         self.save_annotations()
+        self.filesi = filei
         self.load_image_and_annotations(self.files[self.filesi])
 
+    @qtc.pyqtSlot(qtc.QModelIndex)
+    def load_clicked_thumbnail(self, index: qtc.QModelIndex):
+        # The grid shows the file list's rows, so this opens the same file and goes back to it.
+        self.load_clicked_image(index)
+        self.ui.btn_grid_view.setChecked(False)
+        self.select_current_file_row()
+
+    @qtc.pyqtSlot(bool)
+    def on_grid_view_toggled(self, grid: bool):
+        for widget in (self.ui.lbl_display, self.ui.hsb_display, self.ui.vsb_display):
+            widget.setVisible(not grid)
+        self.ui.lstv_thumbs.setVisible(grid)
+        if grid:
+            self.select_current_file_row()
+            self.ui.lstv_thumbs.setFocus()
+
+    def select_current_file_row(self):
+        row = self.file_model.row_of(self.filesi)
+        if row < 0:
+            self.ui.lstv_files.clearSelection()
+            self.ui.lstv_thumbs.clearSelection()
+            return
+        index = self.file_model.index(row)
+        self._setCurrentIndex_no_signal(self.ui.lstv_files, index)
+        self.ui.lstv_files.scrollTo(index)
+        if self.ui.lstv_thumbs.isVisible():
+            index = self.thumb_model.mapFromSource(index)
+            self._setCurrentIndex_no_signal(self.ui.lstv_thumbs, index)
+            self.ui.lstv_thumbs.scrollTo(index)
+
     @qtc.pyqtSlot(qtw.QListWidgetItem)
     def select_bbox_from_lstw(self, item: qtw.QListWidgetItem):
         lstw = item.listWidget()
@@ -154,19 +317,34 @@ class MainWindow(qtw.QMainWindow):
         self.sgl_select_box.emit(i)
 
     def load_image_and_annotations(self, imgpath: str):
-        img = cv2.imread(imgpath)
-        if img is None:
-            print(f'Failed to load file {imgpath}')
+        # Only the header is read here, Display decodes the pixels once on its own thread.
+        try:
+            source = ImageSource(imgpath, self.prefetcher.get)
+        except OSError:
+            self.xlog(f'Failed to load file {imgpath}', logging.ERROR)
             return
-        h, w, _ = img.shape
-        self.ui.lbl_resolution.setText(f'{w} x {h}')
+        self.ui.lbl_resolution.setText(f'{source.width} x {source.height}')
+        # Coming back to an image whose labels are still queued must read the new file, and
+        # edits recovered from a crashed session have to land before the labels are read.
+        if self.journal is not None:
+            self.journal.wait_recovered(os.path.basename(imgpath))
+        self.label_writer.wait(label_stem(imgpath) + '.txt')
         if self.sample is None:
-            self.sample = Sample(imgpath)
+            self.sample = Sample()
             self.sample.sgl_selection_changed.connect(self.on_selection_changed)
             self.sample.classes = self.classes
-        else:
-            self.sample.path = imgpath
+        self.sample.journal = self.journal
+        self.sample.set_source(source)
         self.sgl_update_src.emit(self.sample)
+        self.prefetch_neighbours()
+
+    def prefetch_neighbours(self):
+        paths = []
+        for d in range(1, self.prefetch_radius + 1):
+            for filei in (self.file_model.step(self.filesi, d), self.file_model.step(self.filesi, -d)):
+                if filei is not None:
+                    paths.append(self.files[filei])
+        self.prefetcher.prefetch(paths)
 
     def update_sample_displays(self):
         self.ui.lstw_bboxes.clear()
@@ -190,44 +368,118 @@ class MainWindow(qtw.QMainWindow):
         if not path:
             return
         self.classes_file = path
-        self.classes = []
-        line :str
-        with open(path, 'r') as txt:
-            lines = txt.readlines()
-        for line in lines:
-            line = line.strip()
-            if line != '' and len(line) != 0:
-                self.classes.append(line)
+        self.classes = load_classes(path)
         self.ui.ledit_class_file.setText(path)
         self.ui.cbox_class.clear()
         self.ui.cbox_class.addItems(self.classes)
         if self.sample is not None:
             self.sample.classes = self.classes
+        self.stats_panel.set_classes(self.classes)
         self.update_sample_displays()
 
     @qtc.pyqtSlot()
-    def save_annotations(self):
+    def update_stats_from_sample(self):
+        # Edits replace only the current image's share of the totals.
+        sample = self.sample
+        if sample is None or sample.path is None or os.path.dirname(sample.path) != self.imgdir:
+            return
+        store = sample.store
+        self.stats.set_image(os.path.basename(sample.path), store.cls[:store.n], store.xywh(), sample.imgw, sample.imgh)
+
+    @qtc.pyqtSlot()
+    def on_save_clicked(self):
+        self.save_annotations(force=True)
+
+    def save_annotations(self, force: bool = False):
+        # Queues the label file on the write-behind LabelWriter; untouched samples are skipped.
         if self.sample == None:
             self.xlog('No file loaded.\n', logging.INFO)
             return
+        if not (force or self.sample.modified):
+            return
         stxt = self.sample.txtpath()
-        with open(stxt, 'w') as txt:
-            txt.writelines(self.sample.bboxes2lines())
-        self.xlog(f'Saved annotations to {stxt}', logging.INFO)
+        boxes = len(self.sample.bboxes)
+        # The sample and the journal are marked saved only once the file has landed, so a failed
+        # write leaves the edits modified and journalled.
+        mark_sample = functools.partial(self.sample.mark_saved, self.sample.store.version, self.sample.path)
+        mark_journal = None
+        if self.journal is not None and self.sample.journal is self.journal:
+            mark_journal = functools.partial(self.journal.mark_saved, os.path.basename(self.sample.path), self.journal.seq)
+
+        def done():
+            mark_sample()
+            if mark_journal is not None:
+                mark_journal()
+
+        self.label_writer.write(stxt, self.sample.bboxes2text(), self.sample.path, boxes, done)
+        if self.files and self.files[self.filesi] == self.sample.path:
+            self.file_model.set_boxes(self.filesi, boxes)
+            self.select_current_file_row()
+
+    def close_journal(self):
+        # The journal is kept on disk only while some of its edits are not in a label file yet.
+        if self.journal is None:
+            return
+        self.label_writer.wait()
+        self.journal.close()
+        self.journal = None
+
+    @qtc.pyqtSlot(str, int)
+    def on_labels_written(self, imgpath: str, boxes: int):
+        if self.dataset is not None and os.path.dirname(imgpath) == self.dataset.directory:
+            self.dataset.record_labels(imgpath, boxes)
+        self.xlog(f'Saved annotations to {label_stem(imgpath)}.txt', logging.INFO)
+
+    @qtc.pyqtSlot(str, str)
+    def on_labels_write_failed(self, path: str, error: str):
+        self.xlog(f'Failed to save annotations to {path}: {error}', logging.ERROR)
 
     def change_box_color(self, x):
         txt = self.ui.cbox_box_color.currentText()
         self.display.color = self.colors[txt]
+        self.display.request_render(DIRTY_BOXES)
 
     # --------------------------------------------------------------
     # Display Loop
     # --------------------------------------------------------------
-    @qtc.pyqtSlot(np.ndarray)
-    def update_display_pixmap(self, img :np.ndarray):
-        qimg = qtg.QImage(img.data, img.shape[1], img.shape[0], img.strides[0], qtg.QImage.Format.Format_BGR888)
+    @qtc.pyqtSlot(FrameBuffer)
+    def update_display_pixmap(self, frame :FrameBuffer):
+        # The QImage wraps the display thread's buffer without copying; fromImage() is the
+        # only copy, after which the buffer goes back to the ring.
+        t = time.perf_counter()
+        qimg = qtg.QImage(frame.storage.data, frame.width, frame.height, frame.bytes_per_line, qtg.QImage.Format.Format_BGR888)
         qpix = qtg.QPixmap.fromImage(qimg)
+        seq = frame.seq
+        self.display.release_frame(frame)
+        self.display.timings.record(seq, pixmap=(time.perf_counter() - t) * 1000)
         self.ui.lbl_display.setPixmap(qpix)
 
+    @qtc.pyqtSlot(bool)
+    def on_frame_timings_toggled(self, on: bool):
+        # Stage percentiles in the status bar; timings are collected either way.
+        self.lbl_frame_timings.setVisible(on)
+        if on:
+            self.update_frame_timings()
+            self.frame_timings_timer.start()
+        else:
+            self.frame_timings_timer.stop()
+
+    @qtc.pyqtSlot()
+    def update_frame_timings(self):
+        self.lbl_frame_timings.setText(self.display.timings.summary())
+
+    @qtc.pyqtSlot()
+    def export_frame_timings(self):
+        path, _ = qtw.QFileDialog.getSaveFileName(self, 'Export Frame Timings', 'frame_timings.csv', 'CSV (*.csv)')
+        if not path:
+            return
+        try:
+            n = self.display.timings.export_csv(path)
+        except OSError as e:
+            self.xlog(f'Failed to export frame timings to {path}: {e}', logging.ERROR)
+            return
+        self.xlog(f'Exported timings of {n} frames to {path}', logging.INFO)
+
     # --------------------------------------------------------------
     # Event callbacks
     # --------------------------------------------------------------
@@ -238,6 +490,16 @@ class MainWindow(qtw.QMainWindow):
         zoom = float(v / 100.0)
         self.ui.lbl_scale.setText(f'x{zoom:.2f}')
 
+    @qtc.pyqtSlot(str)
+    def on_file_filter_changed(self, text: str):
+        self.file_model.set_filter(text)
+        self.select_current_file_row()
+
+    @qtc.pyqtSlot(str)
+    def on_file_sort_changed(self, key: str):
+        self.file_model.set_sort_key(key)
+        self.select_current_file_row()
+
     @qtc.pyqtSlot()
     def on_display_in_focus(self):
         self.ui.frme_display.setFrameShape(qtw.QFrame.Shape.Box)
@@ -251,6 +513,7 @@ class MainWindow(qtw.QMainWindow):
         if self.sample is None:
             return
         self.sample.selected_class = i
+        self.display.request_render(DIRTY_BOXES)
         self.update_sample_displays()
 
     @qtc.pyqtSlot(int)
@@ -302,6 +565,18 @@ class MainWindow(qtw.QMainWindow):
     def _setCurrentRow_no_signal(widget, i :int):
         widget.setCurrentRow(i)
 
+    def closeEvent(self, event: qtg.QCloseEvent):
+        self.save_annotations()
+        self.label_writer.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+        self.prefetcher.shutdown()
+        self.thumb_loader.shutdown()
+        self.scanner.stop()  # closes the dataset index
+        self.scanner_qthread.quit()
+        self.scanner_qthread.wait()
+        super().closeEvent(event)
+
     # --------------------------------------------------------------
     # Logging & Console
     # --------------------------------------------------------------
@@ -313,17 +588,14 @@ class MainWindow(qtw.QMainWindow):
         self.console(msg)
 
     def xlog(self, msg: str, level: int = logging.DEBUG):
+        # Anything above DEBUG is also shown in the console widget.
         if level > logging.DEBUG:
             self.console(msg)
-        if level < self.xlog_level:
-            return
-        if not self.xlog_quiet:
-            print(msg)
-        if not self.xlog_enabled:
-            return
-        logging.log(level, msg)
+        log.log(level, msg)
 
 
 if __name__ == "__main__":
     app = MainApp(sys.argv)
-    sys.exit(app.exec())
+    status = app.exec()
+    logpipe.stop_logging()
+    sys.exit(status)
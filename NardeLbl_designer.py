@@ -149,7 +149,23 @@ class Ui_MainWindow(object):
         self.lbl_scale.setFrameShape(QtWidgets.QFrame.Shape.NoFrame)
         self.lbl_scale.setObjectName("lbl_scale")
         self.horizontalLayout_2.addWidget(self.lbl_scale)
+        self.btn_grid_view = QtWidgets.QPushButton(parent=self.frme_scale)
+        self.btn_grid_view.setFocusPolicy(QtCore.Qt.FocusPolicy.NoFocus)
+        self.btn_grid_view.setCheckable(True)
+        self.btn_grid_view.setObjectName("btn_grid_view")
+        self.horizontalLayout_2.addWidget(self.btn_grid_view)
         self.gridLayout.addWidget(self.frme_scale, 0, 0, 1, 2)
+        self.lstv_thumbs = QtWidgets.QListView(parent=self.frme_display)
+        self.lstv_thumbs.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.lstv_thumbs.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.lstv_thumbs.setMovement(QtWidgets.QListView.Movement.Static)
+        self.lstv_thumbs.setResizeMode(QtWidgets.QListView.ResizeMode.Adjust)
+        self.lstv_thumbs.setLayoutMode(QtWidgets.QListView.LayoutMode.Batched)
+        self.lstv_thumbs.setSpacing(4)
+        self.lstv_thumbs.setViewMode(QtWidgets.QListView.ViewMode.IconMode)
+        self.lstv_thumbs.setUniformItemSizes(True)
+        self.lstv_thumbs.setObjectName("lstv_thumbs")
+        self.gridLayout.addWidget(self.lstv_thumbs, 3, 0, 1, 2)
         self.horizontalLayout.addWidget(self.frme_display)
         self.frme_right_frame = QtWidgets.QFrame(parent=self.centralwidget)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Policy.Minimum, QtWidgets.QSizePolicy.Policy.Preferred)
@@ -186,16 +202,25 @@ class Ui_MainWindow(object):
         self.btn_next_file = QtWidgets.QPushButton(parent=self.frme_right_frame)
         self.btn_next_file.setObjectName("btn_next_file")
         self.gridLayout_2.addWidget(self.btn_next_file, 2, 1, 1, 1)
-        self.lstw_files = QtWidgets.QListWidget(parent=self.frme_right_frame)
+        self.ledit_file_filter = QtWidgets.QLineEdit(parent=self.frme_right_frame)
+        self.ledit_file_filter.setClearButtonEnabled(True)
+        self.ledit_file_filter.setObjectName("ledit_file_filter")
+        self.gridLayout_2.addWidget(self.ledit_file_filter, 4, 0, 1, 1)
+        self.cbox_file_sort = QtWidgets.QComboBox(parent=self.frme_right_frame)
+        self.cbox_file_sort.setObjectName("cbox_file_sort")
+        self.gridLayout_2.addWidget(self.cbox_file_sort, 4, 1, 1, 1)
+        self.lstv_files = QtWidgets.QListView(parent=self.frme_right_frame)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Policy.Expanding, QtWidgets.QSizePolicy.Policy.Maximum)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
-        sizePolicy.setHeightForWidth(self.lstw_files.sizePolicy().hasHeightForWidth())
-        self.lstw_files.setSizePolicy(sizePolicy)
-        self.lstw_files.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
-        self.lstw_files.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
-        self.lstw_files.setObjectName("lstw_files")
-        self.gridLayout_2.addWidget(self.lstw_files, 4, 0, 1, 2)
+        sizePolicy.setHeightForWidth(self.lstv_files.sizePolicy().hasHeightForWidth())
+        self.lstv_files.setSizePolicy(sizePolicy)
+        self.lstv_files.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.lstv_files.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
+        self.lstv_files.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.lstv_files.setUniformItemSizes(True)
+        self.lstv_files.setObjectName("lstv_files")
+        self.gridLayout_2.addWidget(self.lstv_files, 5, 0, 1, 2)
         self.frme_controls = QtWidgets.QFrame(parent=self.frme_right_frame)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Policy.Minimum, QtWidgets.QSizePolicy.Policy.Maximum)
         sizePolicy.setHorizontalStretch(0)
@@ -319,7 +344,7 @@ class Ui_MainWindow(object):
         self.label_10.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
         self.label_10.setObjectName("label_10")
         self.gridLayout_3.addWidget(self.label_10, 2, 0, 1, 3)
-        self.gridLayout_2.addWidget(self.frme_controls, 5, 0, 1, 2)
+        self.gridLayout_2.addWidget(self.frme_controls, 6, 0, 1, 2)
         self.horizontalLayout.addWidget(self.frme_right_frame)
         MainWindow.setCentralWidget(self.centralwidget)
         self.statusbar = QtWidgets.QStatusBar(parent=MainWindow)
@@ -338,10 +363,12 @@ class Ui_MainWindow(object):
         self.btn_save.setText(_translate("MainWindow", "Save Annotations"))
         self._lbl_boxes.setText(_translate("MainWindow", "Boxes"))
         self.lbl_scale.setText(_translate("MainWindow", " x1.00"))
+        self.btn_grid_view.setText(_translate("MainWindow", "Grid"))
         self.lbl_resolution.setText(_translate("MainWindow", "9999 x 9999"))
         self.btn_prev_file.setText(_translate("MainWindow", "Prev Img"))
         self.btn_select_image_dir.setText(_translate("MainWindow", "Select Image Dir"))
         self.btn_next_file.setText(_translate("MainWindow", "Next Img"))
+        self.ledit_file_filter.setPlaceholderText(_translate("MainWindow", "Filter"))
         self._lbl_create_box_key.setText(_translate("MainWindow", "T - Create Box"))
         self.label.setText(_translate("MainWindow", "W"))
         self._lbl_controls_delete.setText(_translate("MainWindow", "Delete -\n"
@@ -0,0 +1,327 @@
+import os
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # before Qt is imported
+import argparse
+import fnmatch
+import json
+import platform
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+import cv2
+import numpy as np
+from PyQt6 import QtCore as qtc
+from PyQt6 import QtWidgets as qtw
+from datasetindex import DatasetIndex, scan_directory
+from display import Display
+from pyramid import ImagePyramid
+from sample import Sample
+from scheduler import DIRTY_BOXES, DIRTY_IMAGE
+from yolo import format_yolo
+
+
+# Headless benchmarks of the hot paths, run as:
+#   python bench.py [--quick] [--only display,boxes,labels,scan] [--output results.json]
+#                   [--baseline old.json] [--threshold 0.2] [--thresholds thresholds.json]
+# Everything runs on synthetic data under Qt's offscreen platform. Results are one JSON
+# document of {name: timings}; with --baseline every median is compared against the older
+# run and the exit code is 1 when one got slower by more than its threshold. --thresholds
+# maps fnmatch patterns of result names to the allowed slowdown, e.g. {"scan.*": 0.3}.
+
+SUITES = ('display', 'boxes', 'labels', 'scan')
+CANVAS = (1280, 800)  # display label size, width x height
+
+
+def measure(fn, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) * 1000)
+    times = np.array(times)
+    return {'median_ms': round(float(np.median(times)), 4), 'p95_ms': round(float(np.percentile(times, 95)), 4),
+            'min_ms': round(float(times.min()), 4), 'n': repeat}
+
+
+def synthetic_image(w: int, h: int, seed: int = 0) -> np.ndarray:
+    # Smooth gradients plus noise, closer to a photo than a flat or random image.
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    img = np.empty((h, w, 3), np.uint8)
+    img[..., 0] = (x + y) / 2
+    img[..., 1] = x[::-1] * 0.5 + y * 0.5
+    img[..., 2] = 128
+    img += rng.integers(0, 16, (h, w, 1), np.uint8)
+    return img
+
+
+def synthetic_boxes(n: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    wh = rng.uniform(0.005, 0.08, (n, 2))
+    centre = rng.uniform(wh / 2, 1 - wh / 2)
+    return rng.integers(0, 4, n).astype(np.int32), np.column_stack([centre, wh])
+
+
+def png_header(w: int, h: int) -> bytes:
+    # Signature and IHDR only: enough for read_image_size(), cheap to write 500k times.
+    ihdr = struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr
+            + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr)))
+
+
+def make_display() -> Display:
+    lbl = qtw.QLabel()
+    lbl.resize(*CANVAS)
+    slider = qtw.QSlider()
+    slider.setRange(10, 1000)
+    hzsb = qtw.QScrollBar()
+    vtsb = qtw.QScrollBar()
+    display = Display(lbl, slider, hzsb, vtsb)
+    display._bench_widgets = (lbl, slider, hzsb, vtsb)  # keep the widgets alive
+    display.sgl_did_display.connect(display.release_frame)
+    return display
+
+
+def load_display(display: Display, img: np.ndarray, boxes: int, zoom: float):
+    h, w = img.shape[:2]
+    sample = Sample()
+    sample.imgw = w
+    sample.imgh = h
+    cls, xywh = synthetic_boxes(boxes)
+    sample.store.extend(cls, xywh)
+    sample.rebuild_index()
+    display.src = img
+    display.src_key = ('bench', w, h)
+    display.pyramid = ImagePyramid(img, background=False)
+    display.sample = sample
+    display.tile_cache.clear()
+    display.scale = zoom
+    display.slider.setValue(round(zoom * 100))
+    # Look at the middle of the image so zoomed-in frames are not clipped to a corner.
+    display._calculate_transform_and_set_scrollbars(img)
+    display.hzsb.setValue(display.hzsb.maximum() // 2)
+    display.vtsb.setValue(display.vtsb.maximum() // 2)
+    display._interactive_until = 0.  # the slider and scrollbar changes above count as input
+
+
+def bench_display(results: dict, quick: bool):
+    # Whole frames through _do_display(): 'cold' re-renders every tile, 'interactive' does the
+    # same as a frame drawn mid-zoom or pan, 'base' re-renders the base layer from cached
+    # tiles, 'overlay' only redraws the boxes.
+    sizes = [(1920, 1080), (4000, 3000)] if quick else [(640, 480), (1920, 1080), (4000, 3000), (8000, 6000)]
+    zooms = [0.25, 1.0] if quick else [0.25, 1.0, 2.0]
+    repeat = 5 if quick else 30
+    display = make_display()
+    for w, h in sizes:
+        img = synthetic_image(w, h)
+        for zoom in zooms:
+            load_display(display, img, 100, zoom)
+            name = f'display.frame.{{}}.{w}x{h}@{zoom:g}'
+
+            def cold():
+                display.tile_cache.clear()
+                display._do_display(DIRTY_IMAGE)
+
+            def interactive():
+                display.tile_cache.clear()
+                display._mark_interaction()
+                display._do_display(DIRTY_IMAGE)
+
+            results[name.format('cold')] = measure(cold, repeat)
+            results[name.format('interactive')] = measure(interactive, repeat)
+            display._interactive_until = 0.
+            results[name.format('base')] = measure(lambda: display._do_display(DIRTY_IMAGE), repeat)
+            results[name.format('overlay')] = measure(lambda: display._do_display(DIRTY_BOXES), repeat)
+
+
+def bench_boxes(results: dict, quick: bool):
+    # _draw_boxes() alone on a 1920x1080 frame at zoom 1, with every box in the image.
+    counts = [10, 1000, 10000] if quick else [10, 100, 1000, 10000]
+    repeat = 5 if quick else 30
+    display = make_display()
+    img = synthetic_image(1920, 1080)
+    for n in counts:
+        load_display(display, img, n, 1.0)
+        transform = display._calculate_transform_and_set_scrollbars(img)
+        _, _, y1, y2, x1, x2, _ = transform
+        frame = np.ascontiguousarray(img[y1:y2, x1:x2])
+        results[f'boxes.draw.{n}'] = measure(lambda: display._draw_boxes(frame, transform), repeat)
+
+
+def bench_labels(results: dict, quick: bool, workdir: str):
+    # Sample.load_bboxes() (read and parse the .txt) and bboxes2lines() (format it back).
+    counts = [100, 10000] if quick else [100, 1000, 10000, 100000]
+    repeat = 5 if quick else 20
+    imgpath = os.path.join(workdir, 'labels.png')
+    with open(imgpath, 'wb') as f:
+        f.write(png_header(1920, 1080))
+    for n in counts:
+        cls, xywh = synthetic_boxes(n)
+        with open(os.path.join(workdir, 'labels.txt'), 'w') as f:
+            f.write(format_yolo(cls, xywh))
+        sample = Sample(imgpath)
+        load = measure(sample.load_bboxes, repeat)
+        load['boxes_per_s'] = round(n / (load['median_ms'] / 1000))
+        results[f'labels.load.{n}'] = load
+        lines = measure(sample.bboxes2lines, repeat)
+        lines['boxes_per_s'] = round(n / (lines['median_ms'] / 1000))
+        results[f'labels.format.{n}'] = lines
+
+
+def bench_scan(results: dict, quick: bool, workdir: str, sizes: list[int]):
+    # A directory of n image headers, half of them labelled: the raw listing, building the
+    # index from nothing and the rescan of an unchanged directory.
+    header = png_header(1920, 1080)
+    label = format_yolo(*synthetic_boxes(3)).encode()
+    for n in sizes:
+        directory = os.path.join(workdir, f'scan-{n}')
+        os.makedirs(directory)
+        for i in range(n):
+            with open(os.path.join(directory, f'{i:07d}.png'), 'wb') as f:
+                f.write(header)
+            if i % 2 == 0:
+                with open(os.path.join(directory, f'{i:07d}.txt'), 'wb') as f:
+                    f.write(label)
+        repeat = 1 if quick or n > 100000 else 3
+
+        def listing():
+            for _ in scan_directory(directory):
+                pass
+
+        results[f'scan.listing.{n}'] = measure(listing, repeat)
+
+        def cold():
+            shutil.rmtree(os.path.join(directory, '.nardelbl'), ignore_errors=True)
+            dataset = DatasetIndex(directory)
+            dataset.refresh()
+            dataset.close()
+
+        results[f'scan.index_cold.{n}'] = measure(cold, repeat, warmup=0)
+
+        def warm():
+            dataset = DatasetIndex(directory)
+            dataset.refresh()
+            dataset.close()
+
+        results[f'scan.index_warm.{n}'] = measure(warm, repeat)
+        shutil.rmtree(directory)
+
+
+def threshold_for(name: str, default: float, thresholds: dict) -> float:
+    # The longest matching pattern wins, so 'scan.index_cold.*' can override 'scan.*'.
+    best = None
+    for pattern in thresholds:
+        if fnmatch.fnmatchcase(name, pattern) and (best is None or len(pattern) > len(best)):
+            best = pattern
+    return thresholds[best] if best is not None else default
+
+
+def compare(results: dict, baseline: dict, default: float, thresholds: dict) -> list[dict]:
+    # One row per result present in both runs; 'regressed' when the median grew past the threshold.
+    rows = []
+    for name, new in results.items():
+        old = baseline.get(name)
+        if old is None or not old.get('median_ms'):
+            continue
+        change = new['median_ms'] / old['median_ms'] - 1
+        limit = threshold_for(name, default, thresholds)
+        rows.append({'name': name, 'baseline_ms': old['median_ms'], 'median_ms': new['median_ms'],
+                     'change': round(change, 4), 'threshold': limit, 'regressed': change > limit})
+    return rows
+
+
+def run(suites: list[str], quick: bool = False, scan_sizes: list[int] = None, workdir: str = None, log=print) -> dict:
+    app = qtw.QApplication.instance() or qtw.QApplication(sys.argv[:1])  # Display needs real widgets
+    results = {}
+    tmp = tempfile.mkdtemp(prefix='nardelbl-bench-', dir=workdir)
+    try:
+        for suite in suites:
+            log(f'Running {suite}...')
+            t = time.perf_counter()
+            if suite == 'display':
+                bench_display(results, quick)
+            elif suite == 'boxes':
+                bench_boxes(results, quick)
+            elif suite == 'labels':
+                bench_labels(results, quick, tmp)
+            elif suite == 'scan':
+                bench_scan(results, quick, tmp, scan_sizes or ([10000] if quick else [10000, 100000]))
+            log(f'  {suite} took {time.perf_counter() - t:.1f} s')
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'qt': qtc.QT_VERSION_STR,
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark display, label parsing and directory scanning.')
+    parser.add_argument('--only', help=f'comma separated suites out of {",".join(SUITES)}')
+    parser.add_argument('--quick', action='store_true', help='fewer sizes and repeats, for a smoke run')
+    parser.add_argument('--scan-sizes', help='comma separated file counts, default 10000,100000')
+    parser.add_argument('--workdir', help='where the synthetic data is written, default the system temp dir')
+    parser.add_argument('--label', help='stored with the results, e.g. a release tag')
+    parser.add_argument('--output', help='results file, default stdout')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed median slowdown, 0.2 = 20%%')
+    parser.add_argument('--thresholds', help='JSON file of {"name pattern": allowed slowdown}')
+    args = parser.parse_args(argv)
+
+    suites = args.only.split(',') if args.only else list(SUITES)
+    unknown = [suite for suite in suites if suite not in SUITES]
+    if unknown:
+        parser.error(f'unknown suite(s): {", ".join(unknown)}')
+    scan_sizes = [int(n) for n in args.scan_sizes.split(',')] if args.scan_sizes else None
+    log = lambda msg: print(msg, file=sys.stderr)
+    report = run(suites, args.quick, scan_sizes, args.workdir, log)
+    report['meta']['label'] = args.label
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        thresholds = {}
+        if args.thresholds:
+            with open(args.thresholds, 'r') as f:
+                thresholds = json.load(f)
+        rows = compare(report['results'], baseline['results'], args.threshold, thresholds)
+        report['comparison'] = {'baseline': args.baseline, 'baseline_meta': baseline.get('meta'), 'rows': rows}
+        for row in rows:
+            mark = 'REGRESSED' if row['regressed'] else ''
+            log(f"{row['name']:<40} {row['baseline_ms']:>10.3f} -> {row['median_ms']:>10.3f} ms "
+                f"{row['change']:>+8.1%} {mark}")
+        if any(row['regressed'] for row in rows):
+            status = 1
+    else:
+        for name, timing in report['results'].items():
+            log(f"{name:<40} {timing['median_ms']:>10.3f} ms")
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        tmp = args.output + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text + '\n')
+        os.replace(tmp, args.output)
+    else:
+        print(text)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
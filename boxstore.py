@@ -0,0 +1,168 @@
+import numpy as np
+
+
+class BoxStore:
+    # Struct-of-arrays storage for the boxes of one image. Rows are kept in list order;
+    # every box also has a stable uid so views and indexes survive deletions.
+
+    COLUMNS = {
+        'cls': np.int32,
+        'cx': np.float64,
+        'cy': np.float64,
+        'w': np.float64,
+        'h': np.float64,
+        'left': np.int64,
+        'top': np.int64,
+        'right': np.int64,
+        'bottom': np.int64,
+        'visible': np.bool_,
+        'selected': np.bool_,
+        'uid': np.int64,
+    }
+
+    def __init__(self, imgw: int = 1, imgh: int = 1, capacity: int = 64, owner=None):
+        self.imgw = imgw
+        self.imgh = imgh
+        self.owner = owner  # notified through box_moved(uid) when a view changes a rectangle
+        self.n = 0
+        self.version = 0  # bumped on every mutation
+        self._next_uid = 0
+        self._rows: dict[int, int] = {}
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.zeros(capacity, dtype))
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, n: int):
+        capacity = len(self.uid)
+        if n <= capacity:
+            return
+        capacity = max(n, capacity * 2)
+        for name in self.COLUMNS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def row_of(self, uid: int) -> int:
+        return self._rows[uid]
+
+    def uids(self) -> np.ndarray:
+        return self.uid[:self.n]
+
+    def append(self, cls: int, cx: float, cy: float, w: float, h: float) -> int:
+        return int(self.extend([cls], [[cx, cy, w, h]])[0])
+
+    def extend(self, cls, xywh) -> np.ndarray:
+        cls = np.asarray(cls, np.int32).reshape(-1)
+        xywh = np.asarray(xywh, np.float64).reshape(-1, 4)
+        k = len(cls)
+        start = self.n
+        self._reserve(start + k)
+        rows = slice(start, start + k)
+        self.cls[rows] = cls
+        self.cx[rows] = xywh[:, 0]
+        self.cy[rows] = xywh[:, 1]
+        self.w[rows] = xywh[:, 2]
+        self.h[rows] = xywh[:, 3]
+        self.visible[rows] = True
+        self.selected[rows] = False
+        uids = np.arange(self._next_uid, self._next_uid + k, dtype=np.int64)
+        self.uid[rows] = uids
+        self._next_uid += k
+        self.n += k
+        self._rows.update(zip(uids.tolist(), range(start, start + k)))
+        self.yolo2rect(rows)
+        return uids
+
+    def insert(self, row: int, cls: int, xywh, uid: int = None) -> int:
+        # Puts a box back at row, shifting the rows after it; used by undo and journal replay.
+        n = self.n
+        if not 0 <= row <= n:
+            raise IndexError(row)
+        if uid is None:
+            uid = self._next_uid
+        self._next_uid = max(self._next_uid, uid + 1)
+        self._reserve(n + 1)
+        for name in self.COLUMNS:
+            col = getattr(self, name)
+            col[row + 1:n + 1] = col[row:n]
+        self.n = n + 1
+        for u in self.uid[row + 1:self.n].tolist():
+            self._rows[u] += 1
+        self.uid[row] = uid
+        self._rows[uid] = row
+        self.visible[row] = True
+        self.selected[row] = False
+        self.set_row(row, cls, xywh)
+        return uid
+
+    def set_row(self, row: int, cls: int, xywh):
+        if not 0 <= row < self.n:
+            raise IndexError(row)
+        self.cls[row] = cls
+        self.cx[row], self.cy[row], self.w[row], self.h[row] = xywh
+        self.yolo2rect(slice(row, row + 1))
+
+    def values(self, row: int) -> tuple:
+        # (cls, cx, cy, w, h) of one row, the form edit records use.
+        return (int(self.cls[row]), float(self.cx[row]), float(self.cy[row]), float(self.w[row]), float(self.h[row]))
+
+    def delete(self, row: int):
+        n = self.n
+        if not 0 <= row < n:
+            raise IndexError(row)
+        del self._rows[int(self.uid[row])]
+        for name in self.COLUMNS:
+            col = getattr(self, name)
+            col[row:n - 1] = col[row + 1:n]
+        self.n = n - 1
+        for uid in self.uid[row:self.n].tolist():
+            self._rows[uid] -= 1
+        self.version += 1
+
+    def clear(self):
+        self.n = 0
+        self._rows.clear()
+        self.version += 1
+
+    def _rows_arg(self, rows):
+        return slice(0, self.n) if rows is None else rows
+
+    def yolo2rect(self, rows=None):
+        rows = self._rows_arg(rows)
+        cx, cy, w, h = self.cx[rows], self.cy[rows], self.w[rows], self.h[rows]
+        # astype truncates toward zero, same as int() in the per-box version.
+        x = ((cx - w / 2.) * self.imgw).astype(np.int64)
+        y = ((cy - h / 2.) * self.imgh).astype(np.int64)
+        self.left[rows] = x
+        self.top[rows] = y
+        self.right[rows] = x + (w * self.imgw).astype(np.int64)
+        self.bottom[rows] = y + (h * self.imgh).astype(np.int64)
+        self.version += 1
+
+    def rect2yolo(self, rows=None):
+        rows = self._rows_arg(rows)
+        left, top, right, bottom = self.left[rows], self.top[rows], self.right[rows], self.bottom[rows]
+        self.w[rows] = (right - left) / self.imgw
+        self.h[rows] = (bottom - top) / self.imgh
+        self.cx[rows] = ((right - left) / 2 + left) / self.imgw
+        self.cy[rows] = ((bottom - top) / 2 + top) / self.imgh
+        self.version += 1
+
+    def clamp(self, rows=None):
+        rows = self._rows_arg(rows)
+        self.left[rows] = np.maximum(self.left[rows], 0)
+        self.right[rows] = np.minimum(self.right[rows], self.imgw)
+        self.top[rows] = np.maximum(self.top[rows], 0)
+        self.bottom[rows] = np.minimum(self.bottom[rows], self.imgh)
+        self.version += 1
+
+    def rects(self, rows=None) -> np.ndarray:
+        rows = self._rows_arg(rows)
+        return np.stack([self.left[rows], self.top[rows], self.right[rows], self.bottom[rows]], axis=-1)
+
+    def xywh(self, rows=None) -> np.ndarray:
+        rows = self._rows_arg(rows)
+        return np.stack([self.cx[rows], self.cy[rows], self.w[rows], self.h[rows]], axis=-1)
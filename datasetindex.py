@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+from imagesource import read_image_size
+
+
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.jpeg', '.jpg', '.tif', '.tiff')
+INDEX_DIR = '.nardelbl'
+
+
+def label_stem(name: str) -> str:
+    # Same rule as Sample.txtpath(): everything before the last '.'.
+    i = name.rfind('.')
+    return name[:i] if i >= 0 else name
+
+
+def count_label_rows(path: str) -> int:
+    try:
+        with open(path, 'rb') as txt:
+            return sum(1 for line in txt if line.strip())
+    except OSError:
+        return 0
+
+
+def scan_directory(directory: str, batch_size: int = 2048):
+    # Yields ({image name: (size, mtime_ns)}, {label stem: mtime_ns}) batches as os.scandir
+    # returns entries, so callers can show the first images before the listing finishes.
+    images = {}
+    labels = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            name = entry.name
+            ext = os.path.splitext(name)[1].lower()
+            try:
+                if ext in IMAGE_EXTENSIONS:
+                    if entry.is_file():
+                        st = entry.stat()
+                        images[name] = (st.st_size, st.st_mtime_ns)
+                elif ext == '.txt':
+                    labels[label_stem(name)] = entry.stat().st_mtime_ns
+            except OSError:
+                continue  # removed while listing
+            if len(images) >= batch_size:
+                yield images, labels
+                images = {}
+                labels = {}
+    if images or labels:
+        yield images, labels
+
+
+class DatasetIndex:
+    # On-disk record of every image in a directory, stored in <dir>/.nardelbl/index.sqlite.
+    # Reopening only re-reads headers and label files of entries whose mtime or size changed.
+    SCHEMA_VERSION = 1
+    REFRESH_BATCH = 512  # images re-read and committed between checks of refresh(cancelled=)
+
+    def __init__(self, directory: str, path: str = None):
+        self.directory = directory
+        if path is None:
+            path = os.path.join(directory, INDEX_DIR, 'index.sqlite')
+        self._lock = threading.Lock()
+        self.updated = 0
+        self.removed = 0
+        self._db = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._create_schema()
+        except (OSError, sqlite3.Error):
+            # Read-only dataset (or an index file we cannot write): keep the index for this session only.
+            if self._db is not None:
+                self._db.close()
+            path = ':memory:'
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._create_schema()
+        self.path = path
+
+    def _create_schema(self):
+        with self._lock:
+            db = self._db
+            (version,) = db.execute('PRAGMA user_version').fetchone()
+            if version != self.SCHEMA_VERSION:
+                db.execute('DROP TABLE IF EXISTS images')
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS images ('
+                'name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, width INTEGER, height INTEGER, '
+                'label_mtime_ns INTEGER, boxes INTEGER)')
+            db.execute(f'PRAGMA user_version={self.SCHEMA_VERSION}')
+            db.commit()
+
+    def scan(self):
+        # One directory pass: {image name: (size, mtime_ns)} and {label stem: mtime_ns}.
+        images = {}
+        labels = {}
+        for batch_images, batch_labels in scan_directory(self.directory):
+            images.update(batch_images)
+            labels.update(batch_labels)
+        return images, labels
+
+    def refresh(self, images: dict = None, labels: dict = None, cancelled=None) -> list[str]:
+        # Brings the index in line with the directory and returns the image paths, sorted.
+        # Changed entries are re-read and committed in batches; cancelled() is checked between
+        # them, and a cancelled refresh returns None with the batches done so far kept.
+        if images is None:
+            images, labels = self.scan()
+        with self._lock:
+            known = {row[0]: row[1:] for row in self._db.execute('SELECT * FROM images')}
+        names = list(images)
+        self.updated = 0
+        self.removed = 0
+        for i in range(0, len(names), self.REFRESH_BATCH):
+            if cancelled is not None and cancelled():
+                return None
+            batch = {name: images[name] for name in names[i:i + self.REFRESH_BATCH]}
+            updates = self._updates(batch, labels, known)
+            if updates:
+                with self._lock:
+                    self._db.executemany('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)', updates)
+                    self._db.commit()
+            self.updated += len(updates)
+        if cancelled is not None and cancelled():
+            return None
+        removed = [(name,) for name in known.keys() - images.keys()]
+        with self._lock:
+            self._db.executemany('DELETE FROM images WHERE name = ?', removed)
+            self._db.commit()
+        self.removed = len(removed)
+        return [os.path.join(self.directory, name) for name in sorted(images)]
+
+    def add(self, images: dict, labels: dict) -> list[tuple]:
+        # Indexes images that appeared after refresh() and returns their rows; nothing is removed.
+        names = list(images)
+        with self._lock:
+            known = {}
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                marks = ','.join('?' * len(chunk))
+                for row in self._db.execute(f'SELECT * FROM images WHERE name IN ({marks})', chunk):
+                    known[row[0]] = row[1:]
+        updates = self._updates(images, labels, known)
+        with self._lock:
+            self._db.executemany('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)', updates)
+            self._db.commit()
+        rows = {row[0]: row for row in updates}
+        return [rows.get(name) or (name, *known[name]) for name in names]
+
+    def _updates(self, images: dict, labels: dict, known: dict) -> list[tuple]:
+        updates = []
+        for name, (size, mtime_ns) in images.items():
+            label_mtime_ns = labels.get(label_stem(name))
+            row = known.get(name)
+            if row is not None and row[0] == size and row[1] == mtime_ns and row[4] == label_mtime_ns:
+                continue
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                width, height = row[2], row[3]
+            else:
+                width, height = self._read_size(name)
+            if row is not None and row[4] == label_mtime_ns:
+                boxes = row[5]
+            elif label_mtime_ns is None:
+                boxes = 0
+            else:
+                boxes = count_label_rows(os.path.join(self.directory, label_stem(name) + '.txt'))
+            updates.append((name, size, mtime_ns, width, height, label_mtime_ns, boxes))
+        return updates
+
+    def _read_size(self, name: str) -> tuple[int, int]:
+        try:
+            size = read_image_size(os.path.join(self.directory, name))
+        except OSError:
+            size = None
+        return size if size is not None else (None, None)
+
+    def get(self, name: str) -> dict:
+        with self._lock:
+            row = self._db.execute('SELECT * FROM images WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        keys = ('name', 'size', 'mtime_ns', 'width', 'height', 'label_mtime_ns', 'boxes')
+        return dict(zip(keys, row))
+
+    def rows(self) -> list[tuple]:
+        with self._lock:
+            return self._db.execute('SELECT * FROM images ORDER BY name').fetchall()
+
+    def record_labels(self, imgpath: str, boxes: int):
+        # Called after a label file has been written so the next reopen does not re-read it.
+        name = os.path.basename(imgpath)
+        try:
+            label_mtime_ns = os.stat(label_stem(imgpath) + '.txt').st_mtime_ns
+        except OSError:
+            label_mtime_ns = None
+        with self._lock:
+            self._db.execute('UPDATE images SET label_mtime_ns = ?, boxes = ? WHERE name = ?',
+                             (label_mtime_ns, boxes, name))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,147 @@
+import os
+import time
+from PyQt6 import QtCore as qtc
+from datasetindex import DatasetIndex, IMAGE_EXTENSIONS, label_stem, scan_directory
+from logpipe import get_logger
+
+
+log = get_logger('scan')
+
+
+class DirectoryScanner(qtc.QObject):
+    # Lists an image directory on the thread it lives in and streams what it finds to the GUI,
+    # then brings the DatasetIndex up to date. Afterwards the directory is watched, and images
+    # that appear in it are indexed and streamed the same way.
+    sgl_batch = qtc.pyqtSignal(str, list)  # directory, [(name, mtime_ns, boxes)]
+    sgl_finished = qtc.pyqtSignal(str, list)  # directory, index rows
+    sgl_added = qtc.pyqtSignal(str, list)  # directory, index rows of new images
+    _sgl_scan = qtc.pyqtSignal(str, object, int)
+    _sgl_stop = qtc.pyqtSignal()
+
+    def __init__(self, first_batch: int = 256, settle_ms: int = 500, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.first_batch = first_batch  # batches double from here, so the model re-sorts O(log n) times
+        self.settle_ms = settle_ms  # quiet time after a change before the directory is diffed
+        self.generation = 0  # bumped from the GUI thread to abandon the running scan
+        self._directory = None
+        self._dataset: DatasetIndex = None
+        self._known = set()
+        self._watcher: qtc.QFileSystemWatcher = None
+        self._timer: qtc.QTimer = None
+        self._sgl_scan.connect(self._on_scan, type=qtc.Qt.ConnectionType.QueuedConnection)
+        self._sgl_stop.connect(self._on_stop, type=qtc.Qt.ConnectionType.BlockingQueuedConnection)
+
+    def scan(self, directory: str, dataset: DatasetIndex):
+        # The scanner takes over the dataset and closes the previous one on its own thread.
+        self.generation += 1
+        self._sgl_scan.emit(directory, dataset, self.generation)
+
+    def stop(self):
+        # Blocks until the scanner has let go of the directory and closed the index. A running
+        # scan sees the new generation within one DatasetIndex.REFRESH_BATCH, so this is short.
+        self.generation += 1
+        self._sgl_stop.emit()
+
+    @qtc.pyqtSlot(str, object, int)
+    def _on_scan(self, directory: str, dataset: DatasetIndex, generation: int):
+        self._unwatch()
+        if self._dataset is not None and self._dataset is not dataset:
+            self._dataset.close()
+        self._dataset = dataset
+        self._directory = directory
+        t = time.perf_counter()
+        cached = {row[0]: row[6] for row in dataset.rows()}
+        images = {}
+        labels = {}
+        pending = []
+        threshold = self.first_batch
+        for batch_images, batch_labels in scan_directory(directory, self.first_batch):
+            if generation != self.generation:
+                return
+            images.update(batch_images)
+            labels.update(batch_labels)
+            pending.extend((name, mtime_ns, cached.get(name, 0)) for name, (_, mtime_ns) in batch_images.items())
+            if len(pending) >= threshold:
+                self.sgl_batch.emit(directory, pending)
+                pending = []
+                threshold *= 2
+        if pending:
+            self.sgl_batch.emit(directory, pending)
+        if generation != self.generation:
+            return
+        listed = time.perf_counter()
+        if dataset.refresh(images, labels, lambda: generation != self.generation) is None:
+            return
+        self._known = set(images)
+        log.info('Scanned %s', directory, extra={'images': len(images), 'labels': len(labels),
+                                                 'list_s': round(listed - t, 3),
+                                                 'index_s': round(time.perf_counter() - listed, 3),
+                                                 'updated': dataset.updated, 'removed': dataset.removed})
+        self.sgl_finished.emit(directory, dataset.rows())
+        self._watch(directory)
+
+    @qtc.pyqtSlot()
+    def _on_stop(self):
+        self._unwatch()
+        if self._dataset is not None:
+            self._dataset.close()
+            self._dataset = None
+
+    # --------------------------------------------------------------
+    # Watching
+    # --------------------------------------------------------------
+
+    def _watch(self, directory: str):
+        # Created here so both live on the scanner's thread.
+        if self._watcher is None:
+            self._watcher = qtc.QFileSystemWatcher(self)
+            self._watcher.directoryChanged.connect(self._on_directory_changed)
+            self._timer = qtc.QTimer(self)
+            self._timer.setSingleShot(True)
+            self._timer.timeout.connect(self._on_settled)
+        self._watcher.addPath(directory)
+
+    def _unwatch(self):
+        if self._watcher is None:
+            return
+        self._timer.stop()
+        dirs = self._watcher.directories()
+        if dirs:
+            self._watcher.removePaths(dirs)
+
+    @qtc.pyqtSlot(str)
+    def _on_directory_changed(self, path: str):
+        # Capture rigs write files in bursts; wait for the burst to end.
+        self._timer.start(self.settle_ms)
+
+    @qtc.pyqtSlot()
+    def _on_settled(self):
+        # Qt only says that the directory changed. Listing names is cheap, so only entries
+        # not seen before are stat'ed and indexed; nothing already known is touched.
+        directory = self._directory
+        images = {}
+        labels = {}
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    name = entry.name
+                    if name in self._known or os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                        continue
+                    try:
+                        if entry.is_file():
+                            st = entry.stat()
+                            images[name] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError:
+            return
+        if not images:
+            return
+        for name in images:
+            try:
+                labels[label_stem(name)] = os.stat(os.path.join(directory, label_stem(name) + '.txt')).st_mtime_ns
+            except OSError:
+                pass
+        rows = self._dataset.add(images, labels)
+        self._known.update(images)
+        self.sgl_added.emit(directory, rows)
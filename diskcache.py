@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import threading
+import cv2
+import numpy as np
+from logpipe import get_logger
+from regionsource import is_large
+
+
+log = get_logger('io')
+
+# Decoded pixels are kept as <sha1 of path>.raw: a header, the source path, then the
+# C-order pixel buffer at a 64-byte aligned offset. Hits are mapped with np.memmap, so
+# the OS page cache holds them once for every NardeLbl process. Files are written to a
+# temporary name and renamed into place; the file mtime is the LRU clock.
+#   python diskcache.py [--stats] [--clear] [--dir DIR]
+MAGIC = b'NLBLRAW1'
+HEADER = struct.Struct('<8sIIIIqqI')  # magic, height, width, channels, dtype code, source mtime_ns, source size, path bytes
+DTYPES = {1: np.uint8, 2: np.uint16, 3: np.float32}
+DTYPE_CODES = {np.dtype(t): code for code, t in DTYPES.items()}
+ALIGN = 64
+EXTENSIONS = ('.png', '.tif', '.tiff')  # slow to decode; JPEG and BMP decode faster than the cache file is written
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'nardelbl', 'decoded')
+
+
+class DecodedImageCache:
+    # Used as ImagePrefetcher's decode function: load(path) returns the mapped buffer when a
+    # cached copy of the same path, mtime and size exists, otherwise decodes and stores it.
+    # Only the slow formats in extensions are cached, and images under min_bytes decoded are
+    # not worth a file; anything else is just decoded. A cached image may take a quarter of
+    # max_bytes and a large one (regionsource.is_large) most of it; large ones are handed out
+    # mapped from the start so their decoded copy does not stay in RAM.
+
+    def __init__(self, directory: str = None, max_bytes: int = 4 * 1024 ** 3, min_bytes: int = 4 * 1024 ** 2,
+                 decode=cv2.imread, extensions: tuple[str, ...] = EXTENSIONS):
+        self.directory = directory or default_cache_dir()
+        self.extensions = extensions
+        self.max_bytes = max_bytes
+        self.min_bytes = min_bytes
+        self.decode = decode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._nbytes = self.size()  # estimate, other processes add files too
+
+    def entry_path(self, path: str) -> str:
+        digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.raw')
+
+    def load(self, path: str) -> np.ndarray:
+        if not path.lower().endswith(self.extensions):
+            return self.decode(path)
+        img = self.get(path)
+        if img is not None:
+            return img
+        img = self.decode(path)
+        if img is not None and self.put(path, img) and is_large(img.shape[1], img.shape[0]):
+            npath = len(os.path.abspath(path).encode('utf-8'))
+            try:
+                img = np.memmap(self.entry_path(path), img.dtype, 'r', offset=self._data_offset(npath), shape=img.shape)
+            except (OSError, ValueError):
+                pass  # evicted by another process already, keep the decoded copy
+        return img
+
+    def get(self, path: str) -> np.ndarray:
+        try:
+            st = os.stat(path)
+            entry = self.entry_path(path)
+            with open(entry, 'rb') as f:
+                head = f.read(HEADER.size)
+                magic, h, w, c, code, mtime_ns, size, npath = HEADER.unpack(head)
+                source = f.read(npath).decode('utf-8')
+            if magic != MAGIC or mtime_ns != st.st_mtime_ns or size != st.st_size \
+                    or source != os.path.abspath(path) or code not in DTYPES:
+                self.misses += 1
+                return None
+            shape = (h, w, c) if c > 1 else (h, w)
+            img = np.memmap(entry, DTYPES[code], 'r', offset=self._data_offset(npath), shape=shape)
+            os.utime(entry)  # most recently used
+        except (OSError, struct.error, ValueError, UnicodeDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return img
+
+    @staticmethod
+    def _data_offset(npath: int) -> int:
+        return -(-(HEADER.size + npath) // ALIGN) * ALIGN
+
+    def put(self, path: str, img: np.ndarray) -> bool:
+        # True once the file is in place.
+        code = DTYPE_CODES.get(img.dtype)
+        # A large image may fill what evict() leaves, anything else a quarter of the cache.
+        limit = int(self.max_bytes * 0.9) if is_large(img.shape[1], img.shape[0]) else self.max_bytes // 4
+        if code is None or img.nbytes < self.min_bytes or img.nbytes > limit:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        source = os.path.abspath(path).encode('utf-8')
+        h, w = img.shape[:2]
+        c = img.shape[2] if img.ndim == 3 else 1
+        head = HEADER.pack(MAGIC, h, w, c, code, st.st_mtime_ns, st.st_size, len(source)) + source
+        head += b'\0' * (self._data_offset(len(source)) - len(head))
+        entry = self.entry_path(path)
+        fd, tmp = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(head)
+                f.write(np.ascontiguousarray(img).data)
+            os.replace(tmp, entry)
+        except OSError as e:
+            log.warning('Failed to cache decoded %s: %s', path, e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+        with self._lock:
+            self._nbytes += len(head) + img.nbytes
+            over = self._nbytes > self.max_bytes
+        if over:
+            self.evict()
+        return True
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.raw'):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, target: float = 0.9):
+        # Deletes least recently used files until the cache is under target * max_bytes. A
+        # file another process has mapped stays valid there until it is unmapped (on Windows
+        # the delete fails and the file is skipped).
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes * target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._nbytes = total
+        if removed:
+            log.debug('Evicted %d decoded images', removed, extra={'cache_bytes': total})
+
+    def clear(self) -> int:
+        # Returns the number of files deleted.
+        removed = 0
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        with self._lock:
+            self._nbytes = self.size()
+        return removed
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {'directory': self.directory, 'files': len(entries), 'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Inspect or clear the cache of decoded images.')
+    parser.add_argument('--dir', help=f'cache directory, default {default_cache_dir()}')
+    parser.add_argument('--clear', action='store_true', help='delete every cached image')
+    parser.add_argument('--stats', action='store_true', help='print the number of files and bytes')
+    args = parser.parse_args(argv)
+    cache = DecodedImageCache(args.dir)
+    if args.clear:
+        print(f'Deleted {cache.clear()} cached images from {cache.directory}')
+    if args.stats or not args.clear:
+        stats = cache.stats()
+        print(f"{stats['files']} cached images, {stats['bytes'] / 1024 ** 2:.1f} MiB in {stats['directory']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,32 +1,49 @@
 import logging
 import cv2
 import numpy as np
-import math
 from PyQt6 import QtCore as qtc
 from PyQt6 import QtGui as qtg
 from PyQt6 import QtWidgets as qtw
 import time
-from sample import Sample, BBox
+import threading
+from sample import Sample
+from scheduler import RenderScheduler, DIRTY_INPUT, DIRTY_IMAGE, DIRTY_BOXES, DIRTY_VIEWPORT
+from pyramid import ImagePyramid
+from tiles import TileCache, TileRenderer
+from framebuffers import FrameBuffer, FrameBufferRing
+from frametiming import FrameTimings
+from imagesource import ImageSource
+from logpipe import get_logger
+
+
+log = get_logger('display')
 
 
 class Display(qtc.QObject):
-    sgl_did_display = qtc.pyqtSignal(np.ndarray)
-    sgl_do_display = qtc.pyqtSignal()
+    sgl_did_display = qtc.pyqtSignal(FrameBuffer)
     sgl_msg = qtc.pyqtSignal(str)
     sgl_bbox_updated = qtc.pyqtSignal()
     sgl_display_in_focus = qtc.pyqtSignal()
     sgl_display_out_focus = qtc.pyqtSignal()
     sgl_src_updated = qtc.pyqtSignal()
 
-    def __init__(self, lbl: qtw.QLabel, slider: qtw.QSlider, hzsb: qtw.QScrollBar, vtsb: qtw.QScrollBar, *args, **kwargs):
+    def __init__(self, lbl: qtw.QLabel, slider: qtw.QSlider, hzsb: qtw.QScrollBar, vtsb: qtw.QScrollBar, *args, loader=cv2.imread, **kwargs):
         super().__init__(*args, **kwargs)
-        self.xlog_enabled = True
-        self.xlog_level = logging.getLogger().getEffectiveLevel()
-        self.xlog_quiet = False
+        self.loader = loader  # path -> decoded image, shared with MainWindow's prefetch cache
 
         self.ndarray_dtype = np.uint8
         self.sample = None
         self.src: np.ndarray = np.zeros((100, 100, 3), self.ndarray_dtype)
+        self.src_key = None  # (path, mtime) of the loaded image, used to key cached tiles
+        self.pyramid = ImagePyramid(self.src, background=False)
+        self.tile_cache = TileCache()
+        self.tiles = TileRenderer(self.tile_cache)
+        self.framebuffers = FrameBufferRing()
+        self.timings = FrameTimings()
+        self._starved = 0  # dirty flags of frames skipped while every buffer was in use
+        self._base: np.ndarray = None  # scaled and cropped source, reused until the transform or image changes
+        self._base_key = None
+        self.base_rebuilds = 0
         self.lbl :qtw.QLabel = lbl
         self.lbl.mousePressEvent = self._mousePressEvent
         self.lbl.mouseMoveEvent = self._mouseMoveEvent
@@ -35,6 +52,7 @@ class Display(qtc.QObject):
         self.lbl.focusInEvent = self._focusInEvent
         self.lbl.focusOutEvent = self._focusOutEvent
         self.lbl.mouseReleaseEvent = self._mouseReleaseEvent
+        self.lbl.resizeEvent = self._resizeEvent
         self.click_coords = None  # (mouse x, mouse y)
         self.right_clicked = False
         self.right_click_held = False
@@ -58,6 +76,7 @@ class Display(qtc.QObject):
         self.time = time.time()
         self.copy_box_cooldown = 1
         self.delete_selected = False
+        self.history_step = 0  # -1 undo, 1 redo, applied on the next frame
         self.states = States()
         self.hzsb :qtw.QScrollBar = hzsb
         self.vtsb :qtw.QScrollBar = vtsb
@@ -65,13 +84,64 @@ class Display(qtc.QObject):
         slider.setValue(100)
         self.transform: tuple[int, int, int, int, int, int, float] = (100, 100, 0, 100, 0, 100, 1.)
         self.display_in_focus = False
-        self.sgl_do_display.connect(self._do_display, type=qtc.Qt.ConnectionType.QueuedConnection)
-        self.looping = False
+        self.scheduler = RenderScheduler(parent=self)
+        self.scheduler.sgl_frame.connect(self._do_display)
+        # While the view is being zoomed, panned or resized, frames are drawn with cheap sampling
+        # and redrawn at full quality once input has been idle for refine_ms.
+        self.progressive = True
+        self.refine_ms = 150
+        self._interactive_until = 0.
+        self._refine_timer = qtc.QTimer(self)
+        self._refine_timer.setSingleShot(True)
+        self._refine_timer.timeout.connect(self._refine)
+        self._frame_thread_id = None
+        slider.valueChanged.connect(self._on_viewport_changed)
+        hzsb.valueChanged.connect(self._on_viewport_changed)
+        vtsb.valueChanged.connect(self._on_viewport_changed)
+
+    def request_render(self, flags: int = DIRTY_INPUT):
+        self.scheduler.request(flags)
+
+    def release_frame(self, frame: FrameBuffer):
+        self.framebuffers.release(frame)
+        if self._starved:
+            flags = self._starved
+            self._starved = 0
+            self.request_render(flags)
+
+    def frame_stats(self) -> dict:
+        stats = {'scheduled_frames': self.scheduler.frames, 'base_rebuilds': self.base_rebuilds}
+        stats.update(self.framebuffers.stats())
+        stats.update({f'tile_{k}': v for k, v in self.tile_cache.stats().items()})
+        return stats
+
+    def _mark_interaction(self):
+        self._interactive_until = time.perf_counter() + self.refine_ms / 1000
+
+    @qtc.pyqtSlot()
+    def _refine(self):
+        self.request_render(DIRTY_IMAGE)
+
+    def _on_viewport_changed(self, v: int):
+        # Ignore the scrollbar/slider updates made by the frame currently being rendered.
+        if self._frame_thread_id == threading.get_ident():
+            return
+        self._mark_interaction()
+        self.request_render(DIRTY_VIEWPORT)
 
     def _wheelEvent(self, event: qtg.QWheelEvent):
         delta = event.angleDelta().y()
+        if delta == 0:
+            return
         delta = delta / abs(delta)
-        self.wheeldelta = delta
+        self.wheeldelta += delta
+        self._mark_interaction()
+        self.request_render(DIRTY_VIEWPORT)
+
+    def _resizeEvent(self, event: qtg.QResizeEvent):
+        qtw.QLabel.resizeEvent(self.lbl, event)
+        self._mark_interaction()
+        self.request_render(DIRTY_VIEWPORT)
 
     def _focusInEvent(self, event :qtg.QFocusEvent):
         self.sgl_display_in_focus.emit()
@@ -79,43 +149,58 @@ class Display(qtc.QObject):
     def _focusOutEvent(self, event :qtg.QFocusEvent):
         self.right_click_held = False
         self.sgl_display_out_focus.emit()
+        self.request_render()
 
     def _mousePressEvent(self, event :qtg.QMouseEvent):
         if event.button() == qtc.Qt.MouseButton.LeftButton:
             self.click_coords = (event.pos().x(), event.pos().y())
             self.right_clicked = False
-            self.xlog(f'click_coords set to ({event.pos().x()}, {event.pos().y()})')
+            log.debug('click_coords set to (%d, %d)', event.pos().x(), event.pos().y())
+            self.request_render()
             return
         elif event.button() == qtc.Qt.MouseButton.RightButton:
             self.click_coords = None
             self.right_clicked = True
             self.right_click_held = True
             self.skip_deselect = False
-            self.xlog(f'click_coords set to None.')
+            log.debug('click_coords set to None.')
+            self.request_render()
             return
         
     def _mouseReleaseEvent(self, event :qtg.QMouseEvent):
         if event.button() == qtc.Qt.MouseButton.RightButton:
-            print('Right mouse released.')
+            log.debug('Right mouse released.')
             self.right_click_held = False
             self.right_click_released = True
             self.cursorXdelta = 0
             self.cursorYdelta = 0
+            self.request_render()
 
     def _mouseMoveEvent(self, event :qtg.QMouseEvent):
         x = event.pos().x()
         y = event.pos().y()
         if self.right_click_held:
             self.skip_deselect = True
-            self.cursorXdelta = x - self.cursorX
-            self.cursorYdelta = y - self.cursorY
+            # Accumulate, several moves can land between two frames.
+            self.cursorXdelta += x - self.cursorX
+            self.cursorYdelta += y - self.cursorY
+            self._mark_interaction()
         self.cursorX = x
         self.cursorY = y
+        self.request_render()
         
     def _keyPressEvent(self, event :qtg.QKeyEvent):
-        print(f'Key pressed: {event.key()}')
+        log.debug('Key pressed: %s', event.key())
+        if event.modifiers() & qtc.Qt.KeyboardModifier.ControlModifier:
+            shift = event.modifiers() & qtc.Qt.KeyboardModifier.ShiftModifier
+            if event.key() == qtc.Qt.Key.Key_Z:
+                self.history_step = 1 if shift else -1
+            elif event.key() == qtc.Qt.Key.Key_Y:
+                self.history_step = 1
+            self.request_render()
+            return
         isnumkey = self.is_num_key(event.key())
-        print(f'isnumkey = {isnumkey}')
+        log.debug('isnumkey = %d', isnumkey)
         if event.key() == qtc.Qt.Key.Key_T or isnumkey > 0:
             t = time.time()
             if t - self.time > self.copy_box_cooldown:
@@ -123,7 +208,7 @@ class Display(qtc.QObject):
                 self.copy_class = isnumkey - 1
                 self.time = t
             else:
-                print(f'Box creation on cooldown. {t - self.time}')
+                log.debug('Box creation on cooldown. %.2f', t - self.time)
         elif event.key() == qtc.Qt.Key.Key_Delete:
                 self.delete_selected = True
         elif event.key() == qtc.Qt.Key.Key_Q:  # Outward Left
@@ -143,6 +228,7 @@ class Display(qtc.QObject):
         elif event.key() == qtc.Qt.Key.Key_F:  # Inward Bottom
             self.keyNudge[3] = -1
         self.keyPressed = True
+        self.request_render()
 
     @staticmethod
     def is_num_key(k :int):
@@ -168,17 +254,53 @@ class Display(qtc.QObject):
             return 10
         return 0
 
-    def _do_display(self):
-        if self.src is None:
-            self.sgl_do_display.emit()
+    @qtc.pyqtSlot(int)
+    def _do_display(self, dirty: int = DIRTY_INPUT):
+        if self.src is None or self.sample is None:
             return
-        src = self.src.copy()
-        transform = self._calculate_transform_and_set_scrollbars(src)
-        self.transform = transform
-        img = self._transform_src_image(src, transform)
-        img = self._draw_boxes(img, transform)
-        self.sgl_did_display.emit(img)
-        self.sgl_do_display.emit()
+        self._frame_thread_id = threading.get_ident()
+        t0 = time.perf_counter()
+        try:
+            src = self.src
+            transform = self._calculate_transform_and_set_scrollbars(src)
+            self.transform = transform
+            _, _, y1, y2, x1, x2, _ = transform
+            frame = self.framebuffers.acquire(y2 - y1, x2 - x1, src.shape[2], src.dtype)
+            if frame is None:
+                # The GUI thread still holds every buffer, release_frame() will retry.
+                self._starved |= dirty
+                return
+            t1 = time.perf_counter()
+            fast = self.progressive and time.perf_counter() < self._interactive_until
+            base = self._base_layer(src, transform, dirty, fast)
+            if fast:
+                self._refine_timer.start(self.refine_ms)
+            t2 = time.perf_counter()
+            np.copyto(frame.array, base)
+            t3 = time.perf_counter()
+            self._draw_boxes(frame.array, transform)  # overlay: boxes, vertex highlight, selection
+            t4 = time.perf_counter()
+        finally:
+            self._frame_thread_id = None
+        frame.seq = self.timings.begin()
+        self.sgl_did_display.emit(frame)
+        t5 = time.perf_counter()
+        self.timings.record(frame.seq, transform=(t1 - t0) * 1000, render=(t2 - t1) * 1000, copy=(t3 - t2) * 1000,
+                            boxes=(t4 - t3) * 1000, emit=(t5 - t4) * 1000, total=(t5 - t0) * 1000)
+
+    def _base_layer(self, src: np.ndarray, transform: tuple[int, int, int, int, int, int, float], dirty: int,
+                    fast: bool = False) -> np.ndarray:
+        key = (self.src_key, self.pyramid, len(self.pyramid.levels), transform, fast)
+        if key == self._base_key and not dirty & DIRTY_IMAGE:
+            return self._base
+        _, _, y1, y2, x1, x2, _ = transform
+        shape = (y2 - y1, x2 - x1) + src.shape[2:]
+        if self._base is None or self._base.shape != shape or self._base.dtype != src.dtype:
+            self._base = np.empty(shape, src.dtype)
+        self._transform_src_image(src, transform, self._base, fast)
+        self._base_key = key
+        self.base_rebuilds += 1
+        return self._base
 
     def _draw_boxes(self, img: np.ndarray, transform: tuple[int, int, int, int, int, int, float]) -> np.ndarray:
         precrop_h, precrop_w, y1, y2, x1, x2, scale = transform
@@ -200,11 +322,22 @@ class Display(qtc.QObject):
             adjustedClickY = round((clickY + y1) / scale)
         if self.right_click_released:
             if not self.skip_deselect:
+                self.sample.commit_edit()  # a drag cancelled by deselecting still moved the box
                 self.sample.deselect()
                 self.states.dragging_box = False
                 self.states.dragging_vertex = False
                 self.states.box_selected = False
                 self.lbl.setCursor(qtc.Qt.CursorShape.ArrowCursor)
+        if self.history_step:
+            if self.states.dragging_box or self.states.dragging_vertex:
+                self.xlog('Finish the drag before undoing.', logging.INFO)
+            elif self.sample.undo() if self.history_step < 0 else self.sample.redo():
+                self.states.box_selected = False
+                self.states.hovering_over_box = False
+                self.states.hovering_over_vertex = False
+                self.lbl.setCursor(qtc.Qt.CursorShape.ArrowCursor)
+                changed = True
+            self.history_step = 0
         if self.delete_selected:
             self.sample.delete_selected()
             self.delete_selected = False
@@ -220,22 +353,34 @@ class Display(qtc.QObject):
             else:
                 self.xlog('Cannot create a new box while one is selected.', logging.INFO)
             self.copy_box = False
-        for bbox in self.sample.bboxes:
+        # Only boxes that can show up in the viewport, plus a margin for vertex grabs and rounding.
+        margin = (self.sample.vertex_grab_radius + 2) / scale
+        rows = self.sample.rows_in_rect(x1 / scale - margin, y1 / scale - margin,
+                                        x2 / scale + margin, y2 / scale + margin)
+        # Screen rectangles for every candidate at once; views are only created for the
+        # selected or clicked box.
+        store = self.sample.store
+        xs = store.cx[rows] * precrop_w
+        ys = store.cy[rows] * precrop_h
+        ws = store.w[rows] * precrop_w
+        hs = store.h[rows] * precrop_h
+        lefts = np.maximum(0, (xs - ws / 2.).astype(np.int64) - x1)
+        tops = np.maximum(0, (ys - hs / 2.).astype(np.int64) - y1)
+        rights = np.minimum(img_w, (xs + ws / 2.).astype(np.int64) - x1)
+        bottoms = np.minimum(img_h, (ys + hs / 2.).astype(np.int64) - y1)
+        selected_row = self.sample.get_selected_index()
+        for row, visible, lbl, w, h, left, top, right, bottom in zip(
+                rows.tolist(), store.visible[rows].tolist(), store.cls[rows].tolist(), ws.tolist(), hs.tolist(),
+                lefts.tolist(), tops.tolist(), rights.tolist(), bottoms.tolist()):
             box_clicked = False
-            if not bbox.visible:
+            if not visible:
                 continue
-            x :float = bbox.cx * precrop_w
-            y :float = bbox.cy * precrop_h
-            w :float = bbox.w * precrop_w
-            h :float = bbox.h * precrop_h
-            left = max(0, int(x - w / 2.) - x1)
-            top = max(0, int(y - h / 2.) - y1)
-            right = min(img_w, int(x + w / 2.) - x1)
-            bottom = min(img_h, int(y + h / 2.) - y1)
             if (left > right or top > bottom):
                 continue
             rect_thickness = 1
-            if bbox.selected:
+            drag_done = False
+            if row == selected_row:
+                bbox = self.sample.view(row)
                 if self.states.dragging_box:
                     if left_clicked:
                         self.states.dragging_box = False
@@ -243,6 +388,7 @@ class Display(qtc.QObject):
                         y_shift = adjustedClickY - self.anchor[1] - bbox.top
                         self.anchor = None
                         changed = True
+                        drag_done = True
                     else:
                         x_shift = adjustedCurX - self.anchor[0] - bbox.left
                         y_shift = adjustedCurY - self.anchor[1] - bbox.top
@@ -255,29 +401,38 @@ class Display(qtc.QObject):
                     if bbox.bottom + y_shift > self.sample.imgh:
                         y_shift = self.sample.imgh - bbox.bottom
                     bbox.update_box([x_shift, y_shift, x_shift, y_shift])
+                    if drag_done:
+                        self.sample.commit_edit()
                 if self.states.dragging_vertex:
                     if left_clicked:
                         self.states.dragging_vertex = False
                         x_update = adjustedClickX
                         y_update = adjustedClickY
                         changed = True
+                        drag_done = True
                     else:
                         x_update = adjustedCurX
                         y_update = adjustedCurY
                     self.vertexStr = bbox.update_vertex((x_update, y_update), self.vertexStr)
+                    if drag_done:
+                        self.sample.commit_edit()
                 elif not self.states.dragging_vertex and not self.states.dragging_box:
                     if left_clicked:
                         if self.states.hovering_over_box:
                             self.anchor = (adjustedClickX - bbox.left, adjustedClickY - bbox.top)
                             self.states.dragging_box = True
+                            self.sample.begin_edit(bbox)
                         else:
                             vertex, vertexStr = self.check_vertexes(self.click_coords, left, right, top, bottom)
                             if vertex is not None:
                                 self.vertexStr = vertexStr
                                 self.states.dragging_vertex = True
+                                self.sample.begin_edit(bbox)
                     else:  # bbox selected but not dragging anything
                         if self.keyPressed:
+                            self.sample.begin_edit(bbox)
                             bbox.update_box(self.keyNudge)
+                            self.sample.commit_edit()
                             self.keyNudge = [0, 0, 0, 0]
                             self.keyPressed = False
                             changed = True
@@ -300,14 +455,14 @@ class Display(qtc.QObject):
                             if top + h * box_grab_percent < clickY:
                                 if bottom - h * box_grab_percent > clickY:
                                     box_clicked = True
-                                    self.sample.set_selected(bbox)
-            if bbox.selected:
+                                    self.sample.set_selected(self.sample.view(row))
+            if box_clicked or row == selected_row:
                 color = (0, 255, 0)  # green
             else:
-                color = self.sample.class_colors[bbox.lbl]
+                color = self.sample.class_colors[lbl]
             cv2.rectangle(img, (left, top), (right, bottom), color, rect_thickness)
             if box_clicked:
-                self.xlog(f'Box selected: {self.sample.selected_bbox.lbl} (mouse x, y = {clickX}, {clickY})')
+                log.debug('Box selected: %d (mouse x, y = %d, %d)', self.sample.selected_bbox.lbl, clickX, clickY)
         if changed:
             self.sgl_bbox_updated.emit()
         self.right_clicked = False
@@ -419,39 +574,46 @@ class Display(qtc.QObject):
         x2: int = x1 + min(canvas_w, scaled_w)
         return scaled_h, scaled_w, y1, y2, x1, x2, scale
 
-    def _transform_src_image(self, src: np.ndarray, transform: tuple[int, int, int, int, int, int, float]) -> np.ndarray:
+    def _transform_src_image(self, src: np.ndarray, transform: tuple[int, int, int, int, int, int, float],
+                             out: np.ndarray = None, fast: bool = False) -> np.ndarray:
         scaled_h, scaled_w, y1, y2, x1, x2, scale = transform
         # img = cv2.resize(src, (scaled_w, scaled_h), interpolation=cv2.INTER_LINEAR)
         # return img[y1:y2, x1:x2].copy()
-        img = src[int(y1/scale):int(y2/scale),int(x1/scale):int(x2/scale)]
-        return cv2.resize(img, (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+        return self.tiles.render(self.src_key, self.pyramid, transform, out, fast)
+
+    def _on_pyramid_ready(self, pyramid: ImagePyramid):
+        if pyramid is self.pyramid:
+            self.request_render(DIRTY_IMAGE)
     
     @qtc.pyqtSlot(Sample)
     def set_src_and_sample(self, sample :Sample):
-        self.src = cv2.imread(sample.path)
+        if sample.source is None or sample.source.path != sample.path:
+            sample.set_source(ImageSource(sample.path, self.loader))
+        src = sample.source.pixels()
+        if src is None:
+            self.xlog(f'Failed to decode {sample.path}', logging.ERROR)
+            return
+        self.src = src
+        self.src_key = sample.source.key
+        self.pyramid.cancel()
+        self.pyramid = sample.source.pyramid(on_ready=self._on_pyramid_ready)
         if self.sample is None:
             self.sample = sample
         self.sample.reinitialize_vars()
         self.sample.load_bboxes()
-        if not self.looping:
-            self.looping = True
-            self._do_display()
+        self.request_render(DIRTY_IMAGE | DIRTY_BOXES)
         self.sgl_src_updated.emit()
 
     @qtc.pyqtSlot(int)
     def select_box(self, i :int):
         self.sample.set_selected_index(i)
+        self.request_render(DIRTY_BOXES)
 
     def xlog(self, msg: str, level: int = logging.DEBUG):
+        # Anything above DEBUG is also shown in the console widget.
         if level > logging.DEBUG:
             self.sgl_msg.emit(msg)
-        if level < self.xlog_level:
-            return
-        if not self.xlog_quiet:
-            print(msg)
-        if not self.xlog_enabled:
-            return
-        logging.log(level, msg)
+        log.log(level, msg)
 
 
 class States:
@@ -515,9 +677,9 @@ class States:
     @dragging_vertex.setter
     def dragging_vertex(self, x):
         if not self._dragging_vertex and x:
-            print('Dragging vertex.')
+            log.debug('Dragging vertex.')
         if self._dragging_vertex and not x:
-            print('Stopped dragging vertex.')
+            log.debug('Stopped dragging vertex.')
         self._dragging_vertex = x
         if x:
             self._hovering_over_vertex = False
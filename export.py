@@ -0,0 +1,278 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+from xml.sax.saxutils import escape
+import cv2
+from boxstore import BoxStore
+from datasetindex import label_stem, scan_directory
+from imagesource import read_image_size
+from yolo import load_classes, read_yolo
+
+
+# Converts a labelled image directory to COCO JSON, Pascal VOC XML or CSV:
+#   python export.py <image dir> --format coco|voc|csv --output PATH [--resume]
+# Images are handled in fixed-size chunks: sizes come from file headers and labels from the
+# .txt files, read on a thread pool, and the rows are written out before the next chunk is read,
+# so memory does not grow with the dataset. After every chunk the writer's byte offsets are
+# stored in a progress file; --resume truncates the outputs back to them and carries on.
+
+
+def read_sample(imgpath: str):
+    # (width, height, cls, [[left, top, right, bottom]]) with the GUI's pixel rounding; None if unreadable.
+    try:
+        size = read_image_size(imgpath)
+    except OSError:
+        return None
+    if size is None:
+        img = cv2.imread(imgpath)  # format without a parsable header
+        if img is None:
+            return None
+        size = img.shape[1], img.shape[0]
+    store = BoxStore(*size)
+    txtpath = label_stem(imgpath) + '.txt'
+    if os.path.exists(txtpath):
+        labels = read_yolo(txtpath)
+        store.extend(labels.cls, labels.xywh)
+        store.clamp()
+    return size[0], size[1], store.cls[:store.n].tolist(), store.rects().tolist()
+
+
+class ExportWriter:
+    # Streams one image at a time. state() must describe the outputs well enough for
+    # resume() to cut them back to that point.
+
+    def __init__(self, output: str, classes: list[str]):
+        self.output = output
+        self.classes = classes
+
+    def class_name(self, cls: int) -> str:
+        if 0 <= cls < len(self.classes):
+            return self.classes[cls]
+        return str(cls)
+
+    def open(self, state: dict = None):
+        raise NotImplementedError
+
+    def write(self, name: str, width: int, height: int, cls: list[int], rects: list[list[int]]):
+        raise NotImplementedError
+
+    def state(self) -> dict:
+        return {}
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _open_at(path: str, offset: int = None):
+        # Fresh file when offset is None, otherwise the existing file cut back to offset.
+        if offset is None:
+            return open(path, 'w+b')
+        f = open(path, 'r+b')
+        f.truncate(offset)
+        f.seek(offset)
+        return f
+
+    @staticmethod
+    def _sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class CocoWriter(ExportWriter):
+    # images[] goes straight into the output file; annotations[] is streamed to a side file
+    # and appended when the export finishes, followed by categories[]: every class in the
+    # classes file plus any other id the labels used.
+
+    def open(self, state: dict = None):
+        state = state or {}
+        self.images = self._open_at(self.output, state.get('images_offset'))
+        self.annotations = self._open_at(self.output + '.annotations', state.get('annotations_offset'))
+        self.image_id = state.get('image_id', 0)
+        self.annotation_id = state.get('annotation_id', 0)
+        self.category_ids = set(state.get('category_ids', ()))
+        if not state:
+            self.images.write(b'{"info": {"description": "NardeLbl export"}, "images": [')
+
+    def write(self, name, width, height, cls, rects):
+        image_id = self.image_id
+        sep = ', ' if image_id else ''
+        self.images.write((sep + json.dumps({'id': image_id, 'file_name': name, 'width': width, 'height': height})).encode())
+        chunks = []
+        for c, (left, top, right, bottom) in zip(cls, rects):
+            w = right - left
+            h = bottom - top
+            sep = ', ' if self.annotation_id else ''
+            chunks.append(sep + json.dumps({'id': self.annotation_id, 'image_id': image_id, 'category_id': c,
+                                            'bbox': [left, top, w, h], 'area': w * h, 'iscrowd': 0}))
+            self.annotation_id += 1
+        if chunks:
+            self.annotations.write(''.join(chunks).encode())
+            self.category_ids.update(cls)
+        self.image_id += 1
+
+    def state(self):
+        return {'images_offset': self.images.tell(), 'annotations_offset': self.annotations.tell(),
+                'image_id': self.image_id, 'annotation_id': self.annotation_id,
+                'category_ids': sorted(self.category_ids)}
+
+    def flush(self):
+        self._sync(self.images)
+        self._sync(self.annotations)
+
+    def close(self):
+        self.images.write(b'], "annotations": [')
+        self.annotations.seek(0)
+        shutil.copyfileobj(self.annotations, self.images)
+        ids = self.category_ids.union(range(len(self.classes)))
+        categories = [{'id': i, 'name': self.class_name(i)} for i in sorted(ids)]
+        self.images.write(f'], "categories": {json.dumps(categories)}}}\n'.encode())
+        self.images.close()
+        self.annotations.close()
+        os.remove(self.output + '.annotations')
+
+
+class CsvWriter(ExportWriter):
+    HEADER = ['filename', 'width', 'height', 'class', 'xmin', 'ymin', 'xmax', 'ymax']
+
+    def open(self, state: dict = None):
+        state = state or {}
+        self.f = self._open_at(self.output, state.get('offset'))
+        self._buf = io.StringIO()
+        self._csv = csv.writer(self._buf, lineterminator='\n')
+        if not state:
+            self._csv.writerow(self.HEADER)
+            self._drain()
+
+    def _drain(self):
+        self.f.write(self._buf.getvalue().encode())
+        self._buf.seek(0)
+        self._buf.truncate()
+
+    def write(self, name, width, height, cls, rects):
+        for c, (left, top, right, bottom) in zip(cls, rects):
+            self._csv.writerow([name, width, height, self.class_name(c), left, top, right, bottom])
+        self._drain()
+
+    def state(self):
+        return {'offset': self.f.tell()}
+
+    def flush(self):
+        self._sync(self.f)
+
+    def close(self):
+        self.f.close()
+
+
+class VocWriter(ExportWriter):
+    # One <image stem>.xml per image in the output directory; rewriting one is harmless,
+    # so resuming only needs the image count.
+
+    def open(self, state: dict = None):
+        os.makedirs(self.output, exist_ok=True)
+
+    def write(self, name, width, height, cls, rects):
+        objects = ''.join(
+            f'  <object>\n    <name>{escape(self.class_name(c))}</name>\n    <pose>Unspecified</pose>\n'
+            f'    <truncated>0</truncated>\n    <difficult>0</difficult>\n    <bndbox>\n'
+            f'      <xmin>{left}</xmin>\n      <ymin>{top}</ymin>\n      <xmax>{right}</xmax>\n      <ymax>{bottom}</ymax>\n'
+            f'    </bndbox>\n  </object>\n'
+            for c, (left, top, right, bottom) in zip(cls, rects))
+        xml = (f'<annotation>\n  <filename>{escape(name)}</filename>\n'
+               f'  <size>\n    <width>{width}</width>\n    <height>{height}</height>\n    <depth>3</depth>\n  </size>\n'
+               f'{objects}</annotation>\n')
+        with open(os.path.join(self.output, label_stem(name) + '.xml'), 'w', encoding='utf-8') as f:
+            f.write(xml)
+
+
+WRITERS = {'coco': CocoWriter, 'voc': VocWriter, 'csv': CsvWriter}
+
+
+def progress_path(fmt: str, output: str) -> str:
+    if fmt == 'voc':
+        return os.path.join(output, '.export-progress.json')
+    return output + '.progress.json'
+
+
+def names_digest(names: list[str]) -> str:
+    # Identifies the sorted image list an interrupted export was working through.
+    return hashlib.sha1('\n'.join(names).encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def export(directory: str, fmt: str, output: str, classes: list[str] = None, resume: bool = False,
+           jobs: int = 8, chunk: int = 1024, log=print) -> int:
+    names = []
+    for batch_images, _ in scan_directory(directory):
+        names.extend(batch_images)
+    names.sort()
+    writer: ExportWriter = WRITERS[fmt](output, classes or [])
+    progress = progress_path(fmt, output)
+    digest = names_digest(names)
+    done = 0
+    state = None
+    if resume and os.path.exists(progress):
+        with open(progress, 'r') as f:
+            saved = json.load(f)
+        if saved.get('format') == fmt and saved.get('names') == digest:
+            done = saved['done']
+            state = saved['state']
+            log(f'Resuming at image {done} of {len(names)}.')
+        else:
+            log('Directory changed since the interrupted export, starting over.')
+    writer.open(state)
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for start in range(done, len(names), chunk):
+            batch = names[start:start + chunk]
+            samples = pool.map(read_sample, [os.path.join(directory, name) for name in batch])
+            for name, sample in zip(batch, samples):
+                if sample is None:
+                    skipped += 1
+                    log(f'Skipped unreadable image {name}')
+                    continue
+                writer.write(name, *sample)
+            writer.flush()
+            done = start + len(batch)
+            tmp = progress + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'format': fmt, 'images': len(names), 'names': digest, 'done': done,
+                           'state': writer.state()}, f)
+            os.replace(tmp, progress)
+    writer.close()
+    if os.path.exists(progress):
+        os.remove(progress)
+    return len(names) - skipped
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Export the YOLO labels of an image directory.')
+    parser.add_argument('directory')
+    parser.add_argument('--format', choices=sorted(WRITERS), required=True)
+    parser.add_argument('--output', required=True, help='output file, or directory for voc')
+    parser.add_argument('--classes', help='classes file, defaults to <directory>/classes.txt when present')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted export to the same output')
+    parser.add_argument('--jobs', type=int, default=8, help='threads reading headers and label files')
+    parser.add_argument('--chunk', type=int, default=1024, help='images read and written per step')
+    args = parser.parse_args(argv)
+
+    classes_path = args.classes
+    if classes_path is None:
+        default = os.path.join(args.directory, 'classes.txt')
+        classes_path = default if os.path.exists(default) else None
+    classes = load_classes(classes_path) if classes_path else None
+    n = export(args.directory, args.format, args.output, classes, args.resume, args.jobs, max(1, args.chunk),
+               log=lambda msg: print(msg, file=sys.stderr))
+    print(f'Exported {n} images to {args.output}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import bisect
+import numpy as np
+from PyQt6 import QtCore as qtc
+
+
+class FileListModel(qtc.QAbstractListModel):
+    # Rows are created by the view only as they scroll into sight. The model keeps the
+    # file names parallel to MainWindow.files, so a file index (filesi) never changes;
+    # sorting and filtering only change which file each row points at.
+    SORT_KEYS = ('Name', 'Name (desc)', 'Modified', 'Boxes')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._names: list[str] = []
+        self._lower: list[str] = []
+        self._mtimes: list[int] = []
+        self._boxes: list[int] = []
+        self._sort_key = 'Name'
+        self._order: list[int] = []  # file indices in sort order
+        self._by_name: list[int] = []  # file indices in name order, for prefix lookups
+        self._lower_by_name: list[str] = []
+        self._filter = ''
+        self._rows = np.zeros(0, np.int64)  # visible file indices in display order
+        self._row_of = np.zeros(0, np.int64)  # file index -> row, -1 when filtered out
+
+    def rowCount(self, parent: qtc.QModelIndex = qtc.QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def data(self, index: qtc.QModelIndex, role: int = qtc.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        if role == qtc.Qt.ItemDataRole.DisplayRole:
+            return self._names[self._rows[index.row()]]
+        return None
+
+    def sort(self, column: int, order: qtc.Qt.SortOrder = qtc.Qt.SortOrder.AscendingOrder):
+        key = self.SORT_KEYS[column]
+        if order == qtc.Qt.SortOrder.DescendingOrder and key == 'Name':
+            key = 'Name (desc)'
+        self.set_sort_key(key)
+
+    # --------------------------------------------------------------
+    # Contents
+    # --------------------------------------------------------------
+
+    def set_files(self, names: list[str], mtimes: list[int] = None, boxes: list[int] = None):
+        self._names = []
+        self._lower = []
+        self._mtimes = []
+        self._boxes = []
+        self._append(names, mtimes, boxes)
+        self._rebuild()
+
+    def add_files(self, names: list[str], mtimes: list[int] = None, boxes: list[int] = None):
+        self._append(names, mtimes, boxes)
+        self._rebuild()
+
+    def _append(self, names, mtimes, boxes):
+        self._names.extend(names)
+        self._lower.extend(name.lower() for name in names)
+        self._mtimes.extend(mtimes if mtimes is not None else [0] * len(names))
+        self._boxes.extend(boxes if boxes is not None else [0] * len(names))
+
+    def update_boxes(self, boxes: list[int]):
+        self._boxes = list(boxes)
+        if self._sort_key == 'Boxes':
+            self._rebuild()
+
+    def set_boxes(self, filei: int, boxes: int):
+        self._boxes[filei] = boxes
+        if self._sort_key == 'Boxes':
+            self._rebuild()
+
+    def set_sort_key(self, key: str):
+        if key == self._sort_key:
+            return
+        self._sort_key = key
+        self._rebuild()
+
+    def set_filter(self, text: str):
+        text = text.strip().lower()
+        if text == self._filter:
+            return
+        # While typing, the new filter extends the old one, so only the current rows can match.
+        narrowing = self._filter and text.startswith(self._filter) and not self._filter.startswith('^')
+        self._filter = text
+        self.beginResetModel()
+        if narrowing:
+            self._apply_filter(self._rows.tolist())
+        else:
+            self._apply_filter(self._order)
+        self.endResetModel()
+
+    def _rebuild(self):
+        self.beginResetModel()
+        n = len(self._names)
+        self._by_name = sorted(range(n), key=self._lower.__getitem__)
+        self._lower_by_name = [self._lower[i] for i in self._by_name]
+        key = self._sort_key
+        if key == 'Name':
+            self._order = self._by_name
+        elif key == 'Name (desc)':
+            self._order = self._by_name[::-1]
+        elif key == 'Modified':
+            self._order = sorted(range(n), key=self._mtimes.__getitem__, reverse=True)
+        else:
+            self._order = sorted(range(n), key=self._boxes.__getitem__, reverse=True)
+        self._apply_filter(self._order)
+        self.endResetModel()
+
+    def _apply_filter(self, candidates: list[int]):
+        text = self._filter
+        lower = self._lower
+        if not text:
+            rows = candidates
+        elif text.startswith('^'):
+            # '^abc' matches names starting with 'abc' through a binary search on the name order.
+            prefix = text[1:]
+            keys = self._lower_by_name
+            lo = bisect.bisect_left(keys, prefix)
+            hi = bisect.bisect_left(keys, prefix + '\uffff')
+            matches = set(self._by_name[lo:hi])
+            rows = [i for i in self._order if i in matches]
+        else:
+            rows = [i for i in candidates if text in lower[i]]
+        self._rows = np.array(rows, np.int64)
+        self._row_of = np.full(len(self._names), -1, np.int64)
+        self._row_of[self._rows] = np.arange(len(self._rows))
+
+    # --------------------------------------------------------------
+    # Navigation
+    # --------------------------------------------------------------
+
+    def file_index(self, row: int) -> int:
+        return int(self._rows[row])
+
+    def name(self, filei: int) -> str:
+        return self._names[filei]
+
+    def mtime(self, filei: int) -> int:
+        return self._mtimes[filei]
+
+    def row_of(self, filei: int) -> int:
+        if not 0 <= filei < len(self._row_of):
+            return -1
+        return int(self._row_of[filei])
+
+    def step(self, filei: int, delta: int) -> int:
+        # File index delta rows away from filei in display order, None past either end.
+        row = self.row_of(filei)
+        if row < 0:
+            row = -1 if delta > 0 else len(self._rows)
+        row += delta
+        if not 0 <= row < len(self._rows):
+            return None
+        return int(self._rows[row])
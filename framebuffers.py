@@ -0,0 +1,66 @@
+from collections import deque
+import threading
+import numpy as np
+
+
+class FrameBuffer:
+
+    def __init__(self, index: int):
+        self.index = index
+        self.storage: np.ndarray = None  # preallocated at the largest size seen so far
+        self.array: np.ndarray = None  # top-left view of storage holding the current frame
+        self.seq = 0  # FrameTimings seq of the frame it holds
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    @property
+    def bytes_per_line(self):
+        return self.storage.strides[0]
+
+
+class FrameBufferRing:
+    # The display thread renders into a free buffer and hands it to the GUI thread by
+    # reference; the GUI thread gives it back with release() once it has been uploaded.
+
+    def __init__(self, count: int = 3):
+        self.buffers = [FrameBuffer(i) for i in range(count)]
+        self._free = deque(self.buffers)
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.frames = 0
+        self.dropped = 0
+
+    def acquire(self, h: int, w: int, channels: int = 3, dtype=np.uint8) -> FrameBuffer:
+        with self._lock:
+            if not self._free:
+                self.dropped += 1
+                return None
+            buf = self._free.popleft()
+            self.frames += 1
+        storage = buf.storage
+        if storage is None or storage.shape[0] < h or storage.shape[1] < w \
+                or storage.shape[2] != channels or storage.dtype != dtype:
+            cap_h = h if storage is None else max(h, storage.shape[0])
+            cap_w = w if storage is None else max(w, storage.shape[1])
+            buf.storage = np.empty((cap_h, cap_w, channels), dtype)
+            self.allocations += 1
+        buf.array = buf.storage[:h, :w]
+        return buf
+
+    def release(self, buf: FrameBuffer):
+        with self._lock:
+            self._free.append(buf)
+
+    def stats(self) -> dict:
+        return {
+            'frames': self.frames,
+            'allocations': self.allocations,
+            'allocations_per_frame': self.allocations / max(1, self.frames),
+            'dropped': self.dropped,
+        }
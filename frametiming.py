@@ -0,0 +1,85 @@
+import csv
+import threading
+import time
+import numpy as np
+
+
+STAGES = ('transform', 'render', 'copy', 'boxes', 'emit', 'total', 'pixmap')
+
+
+class FrameTimings:
+    # Per-stage milliseconds of the last `window` frames in a ring of rows indexed by frame
+    # seq. The display thread fills a row while rendering and the GUI thread adds the
+    # pixmap upload later, so a frame's stages are written from two threads.
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.seq = 0
+        self._ms = np.full((window, len(STAGES)), np.nan)
+        self._seqs = np.full(window, -1, np.int64)
+        self._wall = np.zeros(window)  # time.time() of each frame, for the CSV
+        self._col = {stage: i for i, stage in enumerate(STAGES)}
+        self._lock = threading.Lock()
+
+    def begin(self) -> int:
+        with self._lock:
+            self.seq += 1
+            slot = self.seq % self.window
+            self._ms[slot] = np.nan
+            self._seqs[slot] = self.seq
+            self._wall[slot] = time.time()
+            return self.seq
+
+    def record(self, seq: int, **stages: float):
+        # Ignored once seq has been overwritten by a newer frame.
+        with self._lock:
+            slot = seq % self.window
+            if self._seqs[slot] != seq:
+                return
+            for stage, ms in stages.items():
+                self._ms[slot, self._col[stage]] = ms
+
+    def clear(self):
+        with self._lock:
+            self._ms[:] = np.nan
+            self._seqs[:] = -1
+
+    def percentiles(self, q=(50, 95, 99)) -> dict:
+        # {stage: (p50, p95, p99)} in ms over the frames in the window, NaN for unseen stages.
+        with self._lock:
+            ms = self._ms[self._seqs >= 0].copy()
+        result = {}
+        for stage, i in self._col.items():
+            col = ms[:, i]
+            col = col[~np.isnan(col)]
+            result[stage] = tuple(np.percentile(col, q).tolist()) if len(col) else (np.nan,) * len(q)
+        return result
+
+    def frames(self) -> int:
+        with self._lock:
+            return int((self._seqs >= 0).sum())
+
+    def export_csv(self, path: str) -> int:
+        # One row per frame in the window, oldest first; returns the number of rows.
+        with self._lock:
+            order = np.argsort(self._seqs)
+            order = order[self._seqs[order] >= 0]
+            seqs = self._seqs[order].tolist()
+            wall = self._wall[order].tolist()
+            ms = self._ms[order].tolist()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'time'] + [f'{stage}_ms' for stage in STAGES])
+            for seq, t, row in zip(seqs, wall, ms):
+                writer.writerow([seq, f'{t:.6f}'] + ['' if np.isnan(v) else f'{v:.4f}' for v in row])
+        return len(seqs)
+
+    def summary(self) -> str:
+        # One line for the status bar, e.g. 'total 4.1/7.9/12.0 ms | render ...' as p50/p95/p99.
+        parts = []
+        for stage, (p50, p95, p99) in self.percentiles().items():
+            if not np.isnan(p50):
+                parts.append(f'{stage} {p50:.1f}/{p95:.1f}/{p99:.1f}')
+        if not parts:
+            return 'No frames timed yet'
+        return f'{self.frames()} frames, p50/p95/p99 ms: ' + ' | '.join(parts)
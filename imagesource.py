@@ -0,0 +1,169 @@
+import os
+import struct
+import threading
+import cv2
+import numpy as np
+from pyramid import ImagePyramid
+from regionsource import RegionPyramid, TIFF_EXTENSIONS, is_large, open_tiff
+
+
+def read_image_size(path: str) -> tuple[int, int]:
+    # (width, height) from the file header without decoding pixels, None if the format is not
+    # recognised or the header is cut short (a file that is still being written).
+    with open(path, 'rb') as f:
+        try:
+            return _read_header_size(f)
+        except struct.error:
+            return None
+
+
+def _read_header_size(f) -> tuple[int, int]:
+    head = f.read(32)
+    if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+        w, h = struct.unpack('>II', head[16:24])
+        return w, h
+    if head[:2] == b'BM':
+        (header_size,) = struct.unpack('<I', head[14:18])
+        if header_size == 12:
+            w, h = struct.unpack('<HH', head[18:22])
+        else:
+            w, h = struct.unpack('<ii', head[18:26])
+        return abs(w), abs(h)
+    if head[:2] == b'\xff\xd8':
+        f.seek(2)
+        return _read_jpeg_size(f)
+    if head[:4] in (b'II*\0', b'MM\0*', b'II+\0', b'MM\0+'):
+        return _read_tiff_size(f, head)
+    return None
+
+
+def _read_tiff_size(f, head: bytes) -> tuple[int, int]:
+    # ImageWidth and ImageLength of the first IFD, classic TIFF or BigTIFF.
+    endian = '<' if head[:2] == b'II' else '>'
+    if head[2:4] in (b'+\0', b'\0+'):
+        (ifd,) = struct.unpack(endian + 'Q', head[8:16])
+        count_fmt, entry_size, value_at = 'Q', 20, 12
+    else:
+        (ifd,) = struct.unpack(endian + 'I', head[4:8])
+        count_fmt, entry_size, value_at = 'H', 12, 8
+    f.seek(ifd)
+    (count,) = struct.unpack(endian + count_fmt, f.read(struct.calcsize(endian + count_fmt)))
+    entries = f.read(count * entry_size)
+    size = {}
+    for i in range(count):
+        tag, kind = struct.unpack_from(endian + 'HH', entries, i * entry_size)
+        if tag in (256, 257):
+            fmt = {3: 'H', 4: 'I', 16: 'Q'}.get(kind)
+            if fmt is None:
+                return None
+            (size[tag],) = struct.unpack_from(endian + fmt, entries, i * entry_size + value_at)
+    if 256 not in size or 257 not in size:
+        return None
+    return size[256], size[257]
+
+
+def _read_jpeg_size(f) -> tuple[int, int]:
+    orientation = 1
+    while True:
+        b = f.read(1)
+        while b and b != b'\xff':
+            b = f.read(1)
+        while b == b'\xff':
+            b = f.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker in (0x01, 0xd8) or 0xd0 <= marker <= 0xd7:
+            continue
+        data = f.read(2)
+        if len(data) < 2:
+            return None
+        (length,) = struct.unpack('>H', data)
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            h, w = struct.unpack('>xHH', f.read(5))
+            # cv2.imread applies the EXIF orientation, so report the size it will decode to.
+            if orientation >= 5:
+                w, h = h, w
+            return w, h
+        if marker == 0xe1:
+            orientation = _exif_orientation(f.read(length - 2)) or orientation
+        elif marker == 0xda:
+            return None
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _exif_orientation(app1: bytes) -> int:
+    if app1[:6] != b'Exif\x00\x00':
+        return None
+    tiff = app1[6:]
+    if tiff[:2] == b'II':
+        endian = '<'
+    elif tiff[:2] == b'MM':
+        endian = '>'
+    else:
+        return None
+    try:
+        (ifd,) = struct.unpack(endian + 'I', tiff[4:8])
+        (count,) = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])
+        for i in range(count):
+            entry = ifd + 2 + 12 * i
+            tag, _, _, value = struct.unpack(endian + 'HHIH', tiff[entry:entry + 10])
+            if tag == 0x0112:
+                return value
+    except struct.error:
+        return None
+    return None
+
+
+class ImageSource:
+    # One visit to an image: dimensions come from the header, pixels are decoded at most once
+    # and the same buffer is handed to Display and Sample. Large TIFFs are not decoded at all:
+    # pixels() is then a TiffLevel that reads the regions the viewport asks for.
+
+    def __init__(self, path: str, loader=cv2.imread):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self._loader = loader
+        self._pixels: np.ndarray = None
+        self._lock = threading.Lock()
+        self._regions = None
+        size = read_image_size(path)
+        if size is not None and is_large(*size) and path.lower().endswith(TIFF_EXTENSIONS):
+            self._regions = open_tiff(path)
+        if size is None:
+            img = self.pixels()
+            if img is None:
+                raise OSError(f'Cannot read image {path}')
+            size = img.shape[1], img.shape[0]
+        self.width, self.height = size
+
+    @property
+    def key(self):
+        return self.path, self.mtime
+
+    @property
+    def large(self) -> bool:
+        return is_large(self.width, self.height)
+
+    def pixels(self) -> np.ndarray:
+        with self._lock:
+            if self._pixels is None:
+                if self._regions is not None:
+                    self._pixels = self._regions.levels[0]
+                else:
+                    self._pixels = self._loader(self.path)
+            return self._pixels
+
+    def pyramid(self, on_ready=None) -> ImagePyramid:
+        # Large images keep their overviews in memory-mapped files rather than in RAM.
+        src = self.pixels()
+        if self._regions is not None:
+            return RegionPyramid(self._regions.levels, on_ready=on_ready)
+        if self.large:
+            return RegionPyramid([src], on_ready=on_ready)
+        return ImagePyramid(src, on_ready=on_ready)
+
+    def release(self):
+        with self._lock:
+            self._pixels = None
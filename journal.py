@@ -0,0 +1,260 @@
+from collections import namedtuple
+import glob
+import os
+import threading
+import time
+from boxstore import BoxStore
+from datasetindex import INDEX_DIR, label_stem
+from yolo import read_yolo, format_yolo
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# One box edit. before/after are (cls, cx, cy, w, h) or None: 'add' only has after, 'del'
+# only before, 'set' both. Boxes are addressed by row, which replays the same way from
+# the same label file, unlike uids.
+EditRecord = namedtuple('EditRecord', ['op', 'row', 'before', 'after'])
+
+_INVERSE_OP = {'add': 'del', 'del': 'add', 'set': 'set'}
+
+
+def invert(record: EditRecord) -> EditRecord:
+    return EditRecord(_INVERSE_OP[record.op], record.row, record.after, record.before)
+
+
+def apply_record(store: BoxStore, record: EditRecord):
+    # Plain store version of Sample.apply_edit(), used when replaying a journal.
+    if record.op == 'add':
+        store.insert(record.row, record.after[0], record.after[1:])
+    elif record.op == 'del':
+        store.delete(record.row)
+    else:
+        store.set_row(record.row, record.after[0], record.after[1:])
+
+
+def _format_values(values) -> str:
+    if values is None:
+        return '- - - - -'
+    cls, cx, cy, w, h = values
+    return f'{int(cls)} {float(cx)!r} {float(cy)!r} {float(w)!r} {float(h)!r}'
+
+
+def _parse_values(fields: list[str]):
+    if fields[0] == '-':
+        return None
+    return (int(fields[0]),) + tuple(float(v) for v in fields[1:5])
+
+
+def _lock(f) -> bool:
+    # Exclusive, non-blocking lock held for as long as a session has its journal open; the OS
+    # drops it when the process dies, which is what makes a journal stale.
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(f.fileno(), 0, os.SEEK_SET)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            os.lseek(f.fileno(), 0, os.SEEK_SET)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    except OSError:
+        pass
+
+
+def is_live(path: str) -> bool:
+    # True while another open session holds the journal at path.
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            if not _lock(f):
+                return True
+            _unlock(f)
+    except OSError:
+        return True  # cannot even open it, leave it alone
+    return False
+
+
+def read_journal(path: str):
+    # Returns ({image name: [(seq, EditRecord)]}, {image name: last saved seq}). A torn last
+    # line from a crash mid-append is dropped.
+    edits = {}
+    saved = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            fields = line.rstrip('\n').split(' ')
+            try:
+                seq = int(fields[0])
+                op = fields[1]
+                if op == 'save':
+                    name = ' '.join(fields[3:])
+                    saved[name] = max(saved.get(name, 0), int(fields[2]))
+                    continue
+                row = int(fields[2])
+                record = EditRecord(op, row, _parse_values(fields[3:8]), _parse_values(fields[8:13]))
+                name = ' '.join(fields[13:])
+            except (IndexError, ValueError):
+                break
+            edits.setdefault(name, []).append((seq, record))
+    return edits, saved
+
+
+def unsaved_edits(edits: dict, saved: dict) -> dict:
+    # {image name: [EditRecord]} for edits made after that image's last landed save.
+    result = {}
+    for name, records in edits.items():
+        last = saved.get(name, 0)
+        tail = [record for seq, record in records if seq > last]
+        if tail:
+            result[name] = tail
+    return result
+
+
+class EditJournal:
+    # Append-only log of box edits for one session, in <dir>/.nardelbl/journal-<pid>-<time>.log.
+    # Each edit is one short line, and a 'save' line marks the seq up to which an image's label
+    # file is on disk. Journals left behind by a crashed session are replayed into the label
+    # files by recover(); a clean close deletes the journal. The open journal is locked, so
+    # another session on the same directory never mistakes it for a crashed one.
+    COMPACT_BYTES = 1024 * 1024
+
+    def __init__(self, directory: str, path: str = None):
+        self.directory = directory
+        if path is None:
+            path = os.path.join(directory, INDEX_DIR, f'journal-{os.getpid()}-{time.time_ns()}.log')
+        self.path = path
+        self.seq = 0
+        self._saved: dict[str, int] = {}
+        self._last_edit: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._recovering: set[str] = set()  # images whose label files recovery has not written yet
+        self._recovered = threading.Event()
+        self._recovered.set()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, 'a', encoding='utf-8', buffering=1)  # line buffered
+        except OSError:
+            self._file = None  # read-only dataset: undo still works, recovery does not
+        else:
+            _lock(self._file)
+
+    def append(self, name: str, record: EditRecord) -> int:
+        with self._lock:
+            self.seq += 1
+            self._last_edit[name] = self.seq
+            if self._file is not None:
+                self._file.write(f'{self.seq} {record.op} {record.row} {_format_values(record.before)} '
+                                 f'{_format_values(record.after)} {name}\n')
+            return self.seq
+
+    def mark_saved(self, name: str, seq: int):
+        # seq is the journal seq the written label text was taken at.
+        with self._lock:
+            if seq <= self._saved.get(name, 0):
+                return
+            self._saved[name] = seq
+            if self._file is None:
+                return
+            self._file.write(f'{self.seq} save {seq} {name}\n')
+            if self._file.tell() > self.COMPACT_BYTES and not self._unsaved_names():
+                # Everything in the journal is in the label files now.
+                self._file.seek(0)
+                self._file.truncate()
+
+    def _unsaved_names(self) -> list[str]:
+        return [name for name, seq in self._last_edit.items() if seq > self._saved.get(name, 0)]
+
+    def unsaved(self) -> list[str]:
+        with self._lock:
+            return self._unsaved_names()
+
+    def close(self):
+        # Keeps the file when edits never made it to disk, so the next session recovers them.
+        with self._lock:
+            if self._file is None:
+                return
+            _unlock(self._file)
+            self._file.close()
+            self._file = None
+            if not self._unsaved_names():
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+
+    # --------------------------------------------------------------
+    # Recovery
+    # --------------------------------------------------------------
+
+    def stale_journals(self) -> list[str]:
+        # Journals of sessions that ended without closing them; open ones are locked.
+        pattern = os.path.join(self.directory, INDEX_DIR, 'journal-*.log')
+        return sorted(path for path in glob.glob(pattern) if path != self.path and not is_live(path))
+
+    def recover(self, writer) -> threading.Thread:
+        # Replays the unsaved tail of every journal left by an earlier session onto its label
+        # file in the background, queues the result on writer (a LabelWriter) and deletes the
+        # journal once those writes have landed. The journals are read here, so
+        # wait_recovered() knows which images to hold back from the start.
+        journals = []
+        for path in self.stale_journals():
+            try:
+                edits, saved = read_journal(path)
+            except OSError:
+                continue
+            journals.append((path, unsaved_edits(edits, saved)))
+        self._recovering = {name for _, pending in journals for name in pending}
+        self._recovered.clear()
+        thread = threading.Thread(target=self._recover, args=(writer, journals), name='journal-recover', daemon=True)
+        thread.start()
+        return thread
+
+    def wait_recovered(self, name: str, timeout: float = None) -> bool:
+        # Blocks while recovery still has to write the labels of image name; False on timeout.
+        if name not in self._recovering:
+            return True
+        return self._recovered.wait(timeout)
+
+    def _recover(self, writer, journals: list):
+        try:
+            for path, pending in journals:
+                for name, records in pending.items():
+                    imgpath = os.path.join(self.directory, name)
+                    store = self.replay(imgpath, records)
+                    writer.write(label_stem(imgpath) + '.txt', format_yolo(store.cls[:store.n], store.xywh()),
+                                 imgpath, store.n)
+                if pending and not writer.wait():
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        finally:
+            self._recovering = set()
+            self._recovered.set()
+
+    @staticmethod
+    def replay(imgpath: str, records: list[EditRecord]) -> BoxStore:
+        store = BoxStore()
+        txtpath = label_stem(imgpath) + '.txt'
+        if os.path.exists(txtpath):
+            labels = read_yolo(txtpath)
+            store.extend(labels.cls, labels.xywh)
+        for record in records:
+            try:
+                apply_record(store, record)
+            except IndexError:
+                break  # the label file changed under the journal, keep what still applies
+        return store
@@ -0,0 +1,154 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sys
+import time
+import numpy as np
+from boxstore import BoxStore
+from datasetindex import label_stem, scan_directory
+from imagesource import read_image_size
+from yolo import load_classes, read_yolo
+
+
+# Headless label checker, run as: python labellint.py <image dir> [--classes classes.txt] [--jobs N]
+# Label files are parsed with the same read_yolo() the GUI uses and converted to pixel rectangles
+# with BoxStore. Work is split into chunks of files and spread over a process pool. Every problem
+# is printed as one JSON object per line; a summary object comes last.
+
+CHECKS = ('malformed', 'out_of_range', 'zero_area', 'bad_class', 'duplicate', 'orphan_label', 'unreadable')
+EPS = 1e-6
+
+
+def _issue(check: str, path: str, lineno: int = None, message: str = '') -> dict:
+    return {'check': check, 'file': path, 'line': lineno, 'message': message}
+
+
+def lint_file(txtpath: str, imgpath: str, nclasses: int = None) -> list[dict]:
+    try:
+        labels = read_yolo(txtpath)
+    except OSError as e:
+        return [_issue('unreadable', txtpath, None, str(e))]
+    issues = [_issue('malformed', txtpath, e.lineno, e.reason) for e in labels.errors]
+    n = len(labels.cls)
+    if n == 0:
+        return issues
+    cls = labels.cls
+    cx, cy, w, h = labels.xywh.T
+    linenos = labels.linenos.tolist()
+
+    bad = (cx < -EPS) | (cx > 1 + EPS) | (cy < -EPS) | (cy > 1 + EPS) | (w > 1 + EPS) | (h > 1 + EPS)
+    bad |= (cx - w / 2 < -EPS) | (cx + w / 2 > 1 + EPS) | (cy - h / 2 < -EPS) | (cy + h / 2 > 1 + EPS)
+    for i in np.flatnonzero(bad).tolist():
+        issues.append(_issue('out_of_range', txtpath, linenos[i],
+                             f'cx={float(cx[i])!r} cy={float(cy[i])!r} w={float(w[i])!r} h={float(h[i])!r} leaves the image'))
+
+    # Zero area in pixels, i.e. after the same truncation the display applies.
+    size = None
+    if imgpath is not None:
+        try:
+            size = read_image_size(imgpath)
+        except OSError:
+            size = None
+    if size is not None:
+        store = BoxStore(*size, capacity=n)
+        store.extend(cls, labels.xywh)
+        rects = store.rects()
+        empty = (rects[:, 2] <= rects[:, 0]) | (rects[:, 3] <= rects[:, 1])
+        where = f'in a {size[0]}x{size[1]} image'
+    else:
+        empty = (w <= 0) | (h <= 0)
+        where = 'in relative coordinates'
+    for i in np.flatnonzero(empty).tolist():
+        issues.append(_issue('zero_area', txtpath, linenos[i], f'box has no area {where}'))
+
+    wrong = cls < 0
+    if nclasses is not None:
+        wrong |= cls >= nclasses
+    for i in np.flatnonzero(wrong).tolist():
+        issues.append(_issue('bad_class', txtpath, linenos[i],
+                             f'class id {int(cls[i])} is outside 0..{nclasses - 1 if nclasses is not None else "n"}'))
+
+    if n > 1:
+        rows = np.column_stack([cls.astype(np.float64), labels.xywh])
+        _, first, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        for i in np.flatnonzero(first[inverse] != np.arange(n)).tolist():
+            issues.append(_issue('duplicate', txtpath, linenos[i], f'same box as line {linenos[first[inverse[i]]]}'))
+    return issues
+
+
+def lint_chunk(args) -> list[dict]:
+    pairs, nclasses = args
+    issues = []
+    for txtpath, imgpath in pairs:
+        issues.extend(lint_file(txtpath, imgpath, nclasses))
+    return issues
+
+
+def collect(directory: str) -> tuple[list[tuple[str, str]], list[str]]:
+    # ([(label path, image path or None)], [orphan label paths]) from one directory pass.
+    images = {}
+    labels = set()
+    for batch_images, batch_labels in scan_directory(directory):
+        for name in batch_images:
+            images[label_stem(name)] = os.path.join(directory, name)
+        labels.update(batch_labels)
+    labels.discard('classes')
+    pairs = []
+    orphans = []
+    for stem in sorted(labels):
+        txtpath = os.path.join(directory, stem + '.txt')
+        imgpath = images.get(stem)
+        if imgpath is None:
+            orphans.append(txtpath)
+        pairs.append((txtpath, imgpath))
+    return pairs, orphans
+
+
+def lint_directory(directory: str, classes: list[str] = None, jobs: int = None, chunk: int = 256) -> tuple[list[dict], int]:
+    pairs, orphans = collect(directory)
+    issues = [_issue('orphan_label', path, None, 'no image with this name') for path in orphans]
+    nclasses = len(classes) if classes else None
+    chunks = [(pairs[i:i + chunk], nclasses) for i in range(0, len(pairs), chunk)]
+    if jobs == 1 or len(chunks) <= 1:
+        results = map(lint_chunk, chunks)
+        for result in results:
+            issues.extend(result)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for result in pool.map(lint_chunk, chunks):
+                issues.extend(result)
+    return issues, len(pairs)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Check the YOLO label files of an image directory.')
+    parser.add_argument('directory')
+    parser.add_argument('--classes', help='classes file, defaults to <directory>/classes.txt when present')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes, defaults to the CPU count')
+    parser.add_argument('--chunk', type=int, default=256, help='label files handed to a worker at a time')
+    args = parser.parse_args(argv)
+
+    classes_path = args.classes
+    if classes_path is None:
+        default = os.path.join(args.directory, 'classes.txt')
+        classes_path = default if os.path.exists(default) else None
+    classes = load_classes(classes_path) if classes_path else None
+
+    t = time.perf_counter()
+    issues, nfiles = lint_directory(args.directory, classes, args.jobs, max(1, args.chunk))
+    out = sys.stdout
+    for issue in issues:
+        out.write(json.dumps(issue) + '\n')
+    counts = {check: 0 for check in CHECKS}
+    for issue in issues:
+        counts[issue['check']] += 1
+    summary = {'summary': {'directory': args.directory, 'label_files': nfiles, 'classes': len(classes) if classes else None,
+                           'issues': len(issues), 'by_check': counts, 'seconds': round(time.perf_counter() - t, 3)}}
+    out.write(json.dumps(summary) + '\n')
+    return 1 if issues else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
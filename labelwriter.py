@@ -0,0 +1,116 @@
+from collections import OrderedDict
+import os
+import stat
+import tempfile
+import threading
+from PyQt6 import QtCore as qtc
+from logpipe import get_logger
+
+
+log = get_logger('io')
+
+# umask is process-wide and can only be read by setting it, so read it once at import, before
+# the writer and the other worker threads start creating files.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_atomic(path: str, text: str):
+    # Writes next to the target and renames over it, so a crash leaves either the old
+    # file or the new one, never a truncated one.
+    directory, name = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory or None)
+    try:
+        # mkstemp creates the file 0600; keep the old file's mode, or the usual 0666 less the umask.
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp, mode)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class LabelWriter(qtc.QObject):
+    # Write-behind queue for label files, drained by one background thread. A save of a path
+    # that is still waiting replaces the queued text, so only the newest version is written.
+    sgl_written = qtc.pyqtSignal(str, int)  # image path, boxes
+    sgl_failed = qtc.pyqtSignal(str, str)  # label path, error
+
+    def __init__(self, write=write_atomic, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_file = write
+        self.written = 0
+        self.merged = 0
+        self.failed = 0
+        self._pending: OrderedDict = OrderedDict()  # label path -> (text, image path, boxes, done)
+        self._busy = None  # label path being written
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='labelwriter', daemon=True)
+        self._thread.start()
+
+    def write(self, path: str, text: str, imgpath: str = '', boxes: int = 0, done=None):
+        # done() runs on the writer thread once the file is in place.
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('LabelWriter is shut down')
+            if path in self._pending:
+                self.merged += 1
+            self._pending[path] = (text, imgpath, boxes, done)
+            self._cond.notify_all()
+
+    def pending(self, path: str = None) -> bool:
+        with self._cond:
+            return self._is_pending(path)
+
+    def wait(self, path: str = None, timeout: float = None) -> bool:
+        # Blocks until path (or everything when None) is on disk; False on timeout.
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._is_pending(path), timeout)
+
+    def _is_pending(self, path):
+        if path is None:
+            return bool(self._pending) or self._busy is not None
+        return path in self._pending or self._busy == path
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                path, (text, imgpath, boxes, done) = self._pending.popitem(last=False)
+                self._busy = path
+            try:
+                self.write_file(path, text)
+            except OSError as e:
+                self.failed += 1
+                log.warning('Failed to write %s: %s', path, e)
+                self.sgl_failed.emit(path, str(e))
+            else:
+                self.written += 1
+                log.debug('Wrote %s', path, extra={'boxes': boxes})
+                if done is not None:
+                    done()
+                self.sgl_written.emit(imgpath, boxes)
+            finally:
+                with self._cond:
+                    self._busy = None
+                    self._cond.notify_all()
+
+    def shutdown(self, timeout: float = None):
+        # Writes whatever is still queued before the thread exits.
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
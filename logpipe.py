@@ -0,0 +1,108 @@
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+
+# Loggers of the app's subsystems; set_level() and NARDELBL_LOG address them by the short name.
+SUBSYSTEMS = ('ui', 'display', 'sample', 'scan', 'io')
+ROOT = 'nardelbl'
+
+_listener: logging.handlers.QueueListener = None
+_base_level = logging.INFO
+# Attributes every LogRecord has; anything else came in through extra= and is written as a field.
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def get_logger(subsystem: str) -> logging.Logger:
+    return logging.getLogger(f'{ROOT}.{subsystem}')
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line: time, level, subsystem, thread, message and any extra= fields.
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': f'{self.formatTime(record, "%Y-%m-%dT%H:%M:%S")}.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'subsystem': record.name[len(ROOT) + 1:] if record.name.startswith(ROOT + '.') else record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value if isinstance(value, (int, float, str, bool, type(None))) else repr(value)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    # The message is merged with its arguments on the calling thread, while they still hold
+    # the values being logged; the JSON is built on the writer thread.
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(path: str = 'nardelbl.log', level: int = logging.INFO, spec: str = None):
+    # Every record goes through a queue to one writer thread, so logging never waits on the
+    # disk. spec (default $NARDELBL_LOG) sets levels, e.g. 'DEBUG' or 'display=DEBUG,scan=INFO'.
+    global _listener, _base_level
+    if _listener is not None:
+        return
+    _base_level = level
+    try:
+        target = logging.handlers.RotatingFileHandler(path, maxBytes=10 * 1024 * 1024, backupCount=2, encoding='utf-8')
+    except OSError:
+        target = logging.StreamHandler()
+    target.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    root = logging.getLogger(ROOT)
+    root.addHandler(_EnqueueHandler(records))
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, target, respect_handler_level=True)
+    _listener.start()
+    root.setLevel(level)
+    apply_spec(spec if spec is not None else os.environ.get('NARDELBL_LOG', ''))
+
+
+def apply_spec(spec: str):
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        name, _, value = part.rpartition('=')
+        set_level(name or None, logging.getLevelName(value.upper()))
+
+
+def set_level(subsystem: str = None, level: int = logging.DEBUG):
+    # None changes every subsystem; safe to call at any time from any thread.
+    if not isinstance(level, int):
+        return
+    if subsystem is None:
+        logging.getLogger(ROOT).setLevel(level)
+        for name in SUBSYSTEMS:
+            get_logger(name).setLevel(logging.NOTSET)
+    else:
+        get_logger(subsystem).setLevel(level)
+
+
+def set_debug(on: bool):
+    set_level(None, logging.DEBUG if on else _base_level)
+
+
+def stop_logging():
+    # Writes out whatever is still queued.
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+import os
+import threading
+import cv2
+import numpy as np
+from imagesource import read_image_size
+from regionsource import is_large
+
+
+class ImagePrefetcher:
+    # Decodes images on a worker pool ahead of navigation and keeps them in an LRU keyed
+    # by (path, mtime), bounded by the total size of the decoded buffers.
+
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024, workers: int = 2, decode=cv2.imread):
+        self.max_bytes = max_bytes
+        self.decode = decode
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict = OrderedDict()
+        self._inflight: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+    @staticmethod
+    def _key(path: str):
+        try:
+            return path, os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def get(self, path: str) -> np.ndarray:
+        key = self._key(path)
+        if key is None:
+            return None
+        with self._lock:
+            img = self._cache.get(key)
+            if img is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return img
+            future = self._inflight.get(key)
+            if future is not None and not future.cancel():
+                self.hits += 1
+            else:
+                future = None
+                self.misses += 1
+        if future is not None:
+            return future.result()
+        return self._load(key)
+
+    def prefetch(self, paths: list[str]):
+        # paths in priority order; queued loads that are no longer wanted are cancelled.
+        wanted = set()
+        for path in paths:
+            key = self._key(path)
+            if key is None or self._is_large(path):
+                continue
+            wanted.add(key)
+            with self._lock:
+                if key in self._cache or key in self._inflight:
+                    continue
+                self._inflight[key] = self._executor.submit(self._load, key)
+        with self._lock:
+            for key, future in list(self._inflight.items()):
+                if key not in wanted and future.cancel():
+                    del self._inflight[key]
+
+    @staticmethod
+    def _is_large(path: str) -> bool:
+        # Large images are read by region or decoded once when opened, never ahead of time.
+        try:
+            size = read_image_size(path)
+        except OSError:
+            return False
+        return size is not None and is_large(*size)
+
+    def _load(self, key) -> np.ndarray:
+        try:
+            img = self.decode(key[0])
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        if img is not None:
+            self._store(key, img)
+        return img
+
+    def _store(self, key, img: np.ndarray):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = img
+            self.nbytes += img.nbytes
+            while self.nbytes > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def stats(self) -> dict:
+        return {
+            'images': len(self._cache),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'inflight': len(self._inflight),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
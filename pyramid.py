@@ -0,0 +1,49 @@
+import threading
+import cv2
+import numpy as np
+
+
+class ImagePyramid:
+    # levels[0] is the source image, every following level is half the size of the one before.
+
+    def __init__(self, src: np.ndarray, min_size: int = 256, on_ready=None, background: bool = True):
+        self.src = src
+        self.min_size = min_size
+        self.on_ready = on_ready
+        self.levels: list[np.ndarray] = [src]
+        self.ready = False
+        self._cancelled = False
+        if background:
+            self._thread = threading.Thread(target=self._build, daemon=True)
+            self._thread.start()
+        else:
+            self._build()
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _build(self):
+        img = self.src
+        while min(img.shape[0], img.shape[1]) // 2 >= self.min_size:
+            if self._cancelled:
+                return
+            size = ((img.shape[1] + 1) // 2, (img.shape[0] + 1) // 2)
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            # Readers on the display thread iterate self.levels, so swap in a new list.
+            self.levels = self.levels + [img]
+        self.ready = True
+        if self.on_ready is not None and not self._cancelled:
+            self.on_ready(self)
+
+    def level_scale(self, k: int) -> tuple[float, float]:
+        level = self.levels[k]
+        return level.shape[1] / self.src.shape[1], level.shape[0] / self.src.shape[0]
+
+    def level_for_scale(self, scale: float) -> int:
+        # Smallest level that is still at least as large as the requested scale,
+        # so the renderer never has to upsample a level to reach a zoomed-out view.
+        levels = self.levels
+        k = 0
+        while k + 1 < len(levels) and levels[k + 1].shape[1] / self.src.shape[1] >= scale:
+            k += 1
+        return k
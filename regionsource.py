@@ -0,0 +1,211 @@
+from collections import OrderedDict
+import math
+import tempfile
+import threading
+import cv2
+import numpy as np
+from logpipe import get_logger
+from pyramid import ImagePyramid
+try:
+    import tifffile
+except ImportError:  # optional, without it large TIFFs are decoded whole like any other image
+    tifffile = None
+
+
+log = get_logger('io')
+
+LARGE_PIXELS = 8192 * 8192  # above this an image is read by region instead of decoded whole
+MAX_SEGMENT_BYTES = 64 * 1024 * 1024  # a level with bigger tiles or strips is not read by region
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+
+def is_large(width: int, height: int) -> bool:
+    return width * height > LARGE_PIXELS
+
+
+def to_bgr8(region: np.ndarray) -> np.ndarray:
+    # TIFF samples as cv2.imread would return them: 8-bit BGR.
+    if region.dtype == np.uint16:
+        region = (region >> 8).astype(np.uint8)
+    elif region.dtype != np.uint8:
+        region = np.clip(region, 0, 255).astype(np.uint8)
+    if region.ndim == 2 or region.shape[2] == 1:
+        return cv2.cvtColor(region.reshape(region.shape[:2]), cv2.COLOR_GRAY2BGR)
+    if region.shape[2] >= 4:
+        return cv2.cvtColor(np.ascontiguousarray(region[..., :4]), cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(region, cv2.COLOR_RGB2BGR)
+
+
+class SegmentCache:
+    # LRU of decoded TIFF tiles or strips bounded by their total size in bytes. Display tiles
+    # next to each other usually need the same TIFF tile.
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._segments: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> np.ndarray:
+        with self._lock:
+            seg = self._segments.get(key)
+            if seg is not None:
+                self._segments.move_to_end(key)
+            return seg
+
+    def put(self, key, seg: np.ndarray):
+        with self._lock:
+            if key in self._segments:
+                return
+            self._segments[key] = seg
+            self.nbytes += seg.nbytes
+            while self.nbytes > self.max_bytes and len(self._segments) > 1:
+                _, evicted = self._segments.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+
+class TiffLevel:
+    # Array-like view of one TIFF page. Slicing [y0:y1, x0:x1] reads and decodes only the tiles
+    # or strips overlapping the region and returns it as 8-bit BGR, so TileRenderer and
+    # ImagePyramid use it like a decoded image.
+
+    def __init__(self, page, lock: threading.Lock, segments: SegmentCache):
+        self.page = page
+        self._lock = lock  # the file handle is shared by every level
+        self._segments = segments
+        h, w = page.imagelength, page.imagewidth
+        self.shape = (h, w, 3)
+        self.dtype = np.dtype(np.uint8)
+        self.ndim = 3
+        if page.is_tiled:
+            self.seg_h, self.seg_w = page.tilelength, page.tilewidth
+        else:
+            self.seg_h, self.seg_w = min(page.rowsperstrip or h, h), w
+        self.per_row = math.ceil(w / self.seg_w)
+
+    def __getitem__(self, key) -> np.ndarray:
+        ys, xs = key[:2] if isinstance(key, tuple) and len(key) > 1 else (key, slice(None))
+        h, w = self.shape[:2]
+        y0, y1, _ = ys.indices(h)
+        x0, x1, _ = xs.indices(w)
+        out = np.zeros((max(0, y1 - y0), max(0, x1 - x0), 3), np.uint8)
+        if y1 <= y0 or x1 <= x0:
+            return out
+        sh, sw = self.seg_h, self.seg_w
+        for sy in range(y0 // sh, (y1 - 1) // sh + 1):
+            for sx in range(x0 // sw, (x1 - 1) // sw + 1):
+                seg = self._segment(sy * self.per_row + sx)
+                oy = sy * sh
+                ox = sx * sw
+                cy0 = max(y0, oy)
+                cx0 = max(x0, ox)
+                cy1 = min(y1, oy + seg.shape[0])
+                cx1 = min(x1, ox + seg.shape[1])
+                if cy1 > cy0 and cx1 > cx0:
+                    out[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0] = seg[cy0 - oy:cy1 - oy, cx0 - ox:cx1 - ox]
+        return out
+
+    def _segment(self, index: int) -> np.ndarray:
+        key = (id(self), index)
+        seg = self._segments.get(key)
+        if seg is not None:
+            return seg
+        page = self.page
+        count = page.databytecounts[index]
+        if not count:
+            seg = np.zeros((self.seg_h, self.seg_w, 3), np.uint8)  # sparse file, tile never written
+        else:
+            with self._lock:
+                fh = page.parent.filehandle
+                fh.seek(page.dataoffsets[index])
+                data = fh.read(count)
+            decoded = page.decode(data, index, jpegtables=page.jpegtables)[0]
+            seg = to_bgr8(decoded.reshape(decoded.shape[-3:]))
+        self._segments.put(key, seg)
+        return seg
+
+
+class TiffRegions:
+    # The resolution levels of a TIFF, full resolution first: the sub-resolutions of a
+    # pyramidal TIFF, or just the main image of a plain tiled or stripped one.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tif = tifffile.TiffFile(path)
+        lock = threading.Lock()
+        segments = SegmentCache()
+        self.levels: list[TiffLevel] = []
+        try:
+            for series in self._tif.series[0].levels:
+                page = series.keyframe
+                if page.imagedepth > 1 or (page.samplesperpixel > 1 and int(page.planarconfig) != 1):
+                    break  # volumes and planar RGB are not read by region
+                level = TiffLevel(page, lock, segments)
+                if level.seg_h * level.seg_w * 3 > MAX_SEGMENT_BYTES:
+                    break  # e.g. one strip for the whole image, any region read decodes all of it
+                self.levels.append(level)
+        except Exception:
+            self._tif.close()
+            raise
+        if not self.levels:
+            self._tif.close()
+            raise ValueError(f'Unsupported TIFF layout in {path}')
+
+    def close(self):
+        self._tif.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def open_tiff(path: str) -> TiffRegions:
+    # None when tifffile is missing or the file cannot be read by region.
+    if tifffile is None:
+        return None
+    try:
+        return TiffRegions(path)
+    except Exception as e:
+        log.warning('Cannot read %s by region, decoding it whole: %s', path, e)
+        return None
+
+
+class RegionPyramid(ImagePyramid):
+    # Pyramid over levels that are never in memory whole: TiffLevels or a memory-mapped decode.
+    # Levels the file already has are used as they are. Below the smallest one, half-size
+    # overviews are streamed into temporary memory-mapped files a band of rows at a time.
+
+    def __init__(self, levels: list, min_size: int = 256, on_ready=None, background: bool = True,
+                 band_bytes: int = 64 * 1024 * 1024):
+        self.band_bytes = band_bytes
+        self._given = list(levels)
+        super().__init__(levels[0], min_size, on_ready, background)
+
+    def _build(self):
+        self.levels = list(self._given)
+        img = self.levels[-1]
+        while min(img.shape[0], img.shape[1]) // 2 >= self.min_size:
+            img = self._half(img)
+            if img is None:
+                return
+            self.levels = self.levels + [img]
+        self.ready = True
+        if self.on_ready is not None and not self._cancelled:
+            self.on_ready(self)
+
+    def _half(self, level) -> np.ndarray:
+        h, w = level.shape[:2]
+        channels = level.shape[2] if len(level.shape) > 2 else 1
+        shape = ((h + 1) // 2, (w + 1) // 2) + tuple(level.shape[2:])
+        # Deleted by the OS once the last mapping of it goes away.
+        out = np.memmap(tempfile.TemporaryFile(prefix='nardelbl-level-'), level.dtype, 'w+', shape=shape)
+        band = max(2, self.band_bytes // max(1, w * channels * level.dtype.itemsize) // 2 * 2)
+        for y in range(0, h, band):
+            if self._cancelled:
+                return None
+            rows = np.asarray(level[y:min(h, y + band), 0:w])
+            small = cv2.resize(rows, ((rows.shape[1] + 1) // 2, (rows.shape[0] + 1) // 2), interpolation=cv2.INTER_AREA)
+            out[y // 2:y // 2 + small.shape[0]] = small.reshape((small.shape[0],) + shape[1:])
+        return out
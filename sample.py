@@ -2,62 +2,88 @@ from PyQt6 import QtCore as qtc
 from PyQt6 import QtGui as qtg
 from PyQt6 import QtWidgets as qtw
 import os
+import weakref
 import cv2
+import numpy as np
+from imagesource import ImageSource, read_image_size
+from spatial import GridIndex
+from boxstore import BoxStore
+from yolo import LabelError, read_yolo, format_yolo
+from journal import EditJournal, EditRecord, invert
+from logpipe import get_logger
 
 
-class BBox(qtc.QObject):
+log = get_logger('sample')
 
-    def __init__(self, imgw :int, imgh: int, *args, **kwargs):
-        super().__init__(*args, **kwargs)
 
-        self.visible = True
-        self._selected = False
-        self.imgw = imgw
-        self.imgh = imgh
-        self.lbl :int = 0
-        self.left :int = 0
-        self.right :int = 0
-        self.top :int = 0
-        self.bottom :int = 0
-        # relative
-        self.cx :float = 0
-        self.cy :float = 0
-        self.w :float = 0
-        self.h :float = 0
+def _column(name, cast, tracked=True):
+    # tracked columns end up in the label file, so writing them bumps the store version.
+    def fget(self):
+        return cast(getattr(self.store, name)[self.store.row_of(self.uid)])
+
+    def fset(self, value):
+        store = self.store
+        getattr(store, name)[store.row_of(self.uid)] = value
+        if tracked:
+            store.version += 1
+    return property(fget, fset)
+
+
+class BBox:
+    # Thin view over one row of a BoxStore. Sample hands these out, a BBox created
+    # on its own gets a private single-row store.
+    __slots__ = ('store', 'uid', '__weakref__')
+
+    lbl = _column('cls', int)
+    left = _column('left', int)
+    top = _column('top', int)
+    right = _column('right', int)
+    bottom = _column('bottom', int)
+    # relative
+    cx = _column('cx', float)
+    cy = _column('cy', float)
+    w = _column('w', float)
+    h = _column('h', float)
+    visible = _column('visible', bool, tracked=False)
+    _selected = _column('selected', bool, tracked=False)
+
+    def __init__(self, imgw :int = 1, imgh: int = 1, store :BoxStore = None, uid :int = None):
+        if store is None:
+            store = BoxStore(imgw, imgh, capacity=1)
+            uid = store.append(0, 0., 0., 0., 0.)
+        self.store = store
+        self.uid = uid
+
+    @property
+    def row(self) -> int:
+        return self.store.row_of(self.uid)
+
+    @property
+    def imgw(self):
+        return self.store.imgw
+
+    @property
+    def imgh(self):
+        return self.store.imgh
 
     @property
     def selected(self):
         return self._selected
 
-    def yolo2rect(self):
-        imgw = self.imgw
-        imgh = self.imgh
-        x = int((self.cx - self.w / 2.) * imgw)
-        y = int((self.cy - self.h / 2.) * imgh)
-        w = int(self.w * imgw)
-        h = int(self.h * imgh)
-        self.left = x
-        self.top = y
-        self.right = x + w
-        self.bottom = y + h
+    def rect(self):
         return self.left, self.top, self.right, self.bottom
 
+    def _moved(self):
+        if self.store.owner is not None:
+            self.store.owner.box_moved(self.uid)
+
+    def yolo2rect(self):
+        self.store.yolo2rect(self.row)
+        return self.rect()
+
     def rect2yolo(self):
-        imgw = self.imgw
-        imgh = self.imgh
-        left = self.left
-        right = self.right
-        top = self.top
-        bottom = self.bottom
-        w: float = (right - left) / imgw
-        h: float = (bottom - top) / imgh
-        cx: float = ((right - left) / 2 + left) / imgw
-        cy: float = ((bottom - top) / 2 + top) / imgh
-        self.w = w
-        self. h = h
-        self.cx = cx
-        self.cy = cy
-        return cx, cy, w, h
+        self.store.rect2yolo(self.row)
+        return self.cx, self.cy, self.w, self.h
 
     def parse_yolo_line(self, line: str):
         s = line.split(' ')
@@ -123,6 +149,7 @@ class BBox(qtc.QObject):
                 else:
                     self.bottom = y
         self.rect2yolo()
+        self._moved()
         # print(f'left = {self.left} right = {self.right} top = {self.top} bottom = {self.bottom}')
         # print(f'x = {x} y = {y} retXstr = {retXstr} retYstr = {retYstr}')
         return (retXstr, retYstr)
@@ -131,44 +158,57 @@ class BBox(qtc.QObject):
         if shifts is None:
             return
         if shifts[0] != 0:
-            print('left')
-            print(self.left)
             self.left += shifts[0]
             self.left = max(0, self.left)
             self.left = min(self.imgw, self.left)
-            print(self.left)
         if shifts[1] != 0:
-            print('top')
-            print(self.top)
             self.top += shifts[1]
             self.top = max(0, self.top)
             self.top = min(self.imgh, self.top)
-            print(self.top)
         if shifts[2] != 0:
-            print('right')
-            print(self.right)
             self.right += shifts[2]
             self.right = max(0, self.right)
             self.right = min(self.imgw, self.right)
-            print(self.right)
         if shifts[3] != 0:
-            print('bottom')
-            print(self.bottom)
             self.bottom += shifts[3]
             self.bottom = max(0, self.bottom)
             self.bottom = min(self.imgh, self.bottom)
-            print(self.bottom)
-        print('\n')
+        log.debug('Nudged box %d by %s', self.uid, shifts)
         self.rect2yolo()
+        self._moved()
 
     def clamp_box(self):
-        w = self.imgw
-        h = self.imgh
-        self.left = max(0, self.left)
-        self.right = min(w, self.right)
-        self.top = max(0, self.top)
-        self.bottom = min(h, self.bottom)
+        # A box cut at the image edge gets cx/cy/w/h to match, and its rect re-derived from them,
+        # so an edit record of values() restores exactly this box.
+        before = self.rect()
+        self.store.clamp(self.row)
+        if self.rect() != before:
+            rows = slice(self.row, self.row + 1)
+            self.store.rect2yolo(rows)
+            self.store.yolo2rect(rows)
+
+
+class BoxList:
+    # Read-only sequence of BBox views over a Sample's store, in row order.
+
+    def __init__(self, sample):
+        self._sample = sample
+
+    def __len__(self):
+        return self._sample.store.n
+
+    def __getitem__(self, i :int) -> BBox:
+        n = self._sample.store.n
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(i)
+        return self._sample.view(i)
 
+    def __iter__(self):
+        store = self._sample.store
+        for uid in store.uids().tolist():
+            yield self._sample.view_uid(uid)
 
 
 class Sample(qtc.QObject):
@@ -177,7 +217,16 @@ class Sample(qtc.QObject):
     def __init__(self, imgpath: str = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.path = imgpath
-        self.bboxes :list[BBox] = []
+        self.source :ImageSource = None
+        self.store = BoxStore(owner=self)
+        self.index = GridIndex()
+        self._views = weakref.WeakValueDictionary()
+        self.load_errors :list[LabelError] = []
+        self._saved_version = self.store.version  # store version matching the label file
+        self.journal :EditJournal = None  # every edit is appended here when set
+        self._undo :list[EditRecord] = []
+        self._redo :list[EditRecord] = []
+        self._edit_before = None  # (row, values) while a drag or nudge is in progress
         if imgpath is not None:
             self.get_img_dims()
             self.load_bboxes()
@@ -196,12 +245,55 @@ class Sample(qtc.QObject):
         self.last_w = 0.05
         self.last_h = 0.05
         self._selected_class = 0
-        self.bboxes = []
+        self.store.clear()
+        self.index.clear()
+
+    @property
+    def bboxes(self) -> BoxList:
+        return BoxList(self)
+
+    @property
+    def imgw(self):
+        return self.store.imgw
+
+    @imgw.setter
+    def imgw(self, x):
+        self.store.imgw = x
+
+    @property
+    def imgh(self):
+        return self.store.imgh
+
+    @imgh.setter
+    def imgh(self, x):
+        self.store.imgh = x
+
+    def view_uid(self, uid :int) -> BBox:
+        bbox = self._views.get(uid)
+        if bbox is None:
+            bbox = BBox(store=self.store, uid=uid)
+            self._views[uid] = bbox
+        return bbox
+
+    def view(self, row :int) -> BBox:
+        return self.view_uid(int(self.store.uid[row]))
 
     def get_img_dims(self):
-        img = cv2.imread(self.path)
-        self.imgw = img.shape[1]
-        self.imgh = img.shape[0]
+        if self.source is not None and self.source.path == self.path:
+            self.imgw = self.source.width
+            self.imgh = self.source.height
+            return
+        size = read_image_size(self.path)
+        if size is None:
+            img = cv2.imread(self.path)
+            size = img.shape[1], img.shape[0]
+        self.imgw, self.imgh = size
+
+    def set_source(self, source :ImageSource):
+        self.source = source
+        self.path = source.path
+        self.imgw = source.width
+        self.imgh = source.height
 
     @property
     def selected_class(self):
@@ -210,29 +302,28 @@ class Sample(qtc.QObject):
     @selected_class.setter
     def selected_class(self, x):
         self._selected_class = x
-        if self.bbox_selected:
+        if self.bbox_selected and self.selected_bbox.lbl != x:
+            self.begin_edit(self.selected_bbox)
             self.selected_bbox.lbl = x
+            self.commit_edit()
 
     def add_bbox(self, cx, cy, rel_w=None, rel_h=None, class_id=-1):
         if rel_w is None:
             rel_w = self.last_w
         if rel_h is None:
             rel_h = self.last_h
-        bbox = BBox(self.imgw, self.imgh)
         if class_id < 0:
-            bbox.lbl = self.selected_class
+            lbl = self.selected_class
         else:
             class_id = min(class_id, len(self.classes) - 1)
-            bbox.lbl = max(class_id, 0)
-        bbox.cx = cx
-        bbox.cy = cy
-        bbox.w = rel_w
-        bbox.h = rel_h
-        bbox.yolo2rect()
+            lbl = max(class_id, 0)
+        uid = self.store.append(lbl, cx, cy, rel_w, rel_h)
+        bbox = self.view_uid(uid)
         bbox.clamp_box()
-        self.bboxes.append(bbox)
+        self.index.insert(uid, bbox.rect())
+        self.record_edit(EditRecord('add', bbox.row, None, self.store.values(bbox.row)))
         self.set_selected(bbox)
-        print(f'BBox added. {cx} {cy} {rel_w} {rel_h}')
+        log.debug('BBox added. %s %s %s %s', cx, cy, rel_w, rel_h)
         return bbox
 
     @property
@@ -243,6 +334,70 @@ class Sample(qtc.QObject):
     def selected_bbox(self) -> BBox:
         return self._selected_bbox
     
+    # --------------------------------------------------------------
+    # Edit history
+    # --------------------------------------------------------------
+
+    def record_edit(self, record :EditRecord):
+        self._undo.append(record)
+        self._redo.clear()
+        if self.journal is not None:
+            self.journal.append(os.path.basename(self.path), record)
+
+    def begin_edit(self, bbox :BBox):
+        # Called when a drag or nudge starts; commit_edit() records it as a single 'set'.
+        self._edit_before = (bbox.row, self.store.values(bbox.row))
+
+    def commit_edit(self):
+        if self._edit_before is None:
+            return
+        row, before = self._edit_before
+        self._edit_before = None
+        after = self.store.values(row)
+        if after != before:
+            self.record_edit(EditRecord('set', row, before, after))
+
+    def apply_edit(self, record :EditRecord):
+        # Used by undo/redo; the grid index follows every change so hit-testing sees the new rects.
+        store = self.store
+        if record.op == 'add':
+            uid = store.insert(record.row, record.after[0], record.after[1:])
+            self.index.insert(uid, self.view_uid(uid).rect())
+        elif record.op == 'del':
+            uid = int(store.uid[record.row])
+            self.index.remove(uid)
+            store.delete(record.row)
+            self._views.pop(uid, None)
+        else:
+            store.set_row(record.row, record.after[0], record.after[1:])
+            uid = int(store.uid[record.row])
+            self.index.update(uid, self.view_uid(uid).rect())
+
+    def undo(self) -> bool:
+        if not self._undo:
+            return False
+        record = self._undo.pop()
+        self.deselect()
+        self._edit_before = None
+        inverse = invert(record)
+        self.apply_edit(inverse)
+        self._redo.append(record)
+        if self.journal is not None:
+            self.journal.append(os.path.basename(self.path), inverse)
+        return True
+
+    def redo(self) -> bool:
+        if not self._redo:
+            return False
+        record = self._redo.pop()
+        self.deselect()
+        self._edit_before = None
+        self.apply_edit(record)
+        self._undo.append(record)
+        if self.journal is not None:
+            self.journal.append(os.path.basename(self.path), record)
+        return True
+
     def deselect(self):
         if self.bbox_selected:
             self._selected_bbox._selected = False
@@ -257,34 +412,70 @@ class Sample(qtc.QObject):
         i = self.path.rfind('\\')
         return self.path[i+1:]
     
+    def bboxes2text(self) -> str:
+        store = self.store
+        return format_yolo(store.cls[:store.n], store.xywh())
+
+    @property
+    def modified(self) -> bool:
+        # True once a box was added, moved, relabelled or deleted since the last load or save.
+        return self.store.version != self._saved_version
+
+    def mark_saved(self, version: int = None, path: str = None):
+        # version/path pin the save to the boxes that were queued; a stale call is ignored.
+        if path is not None and path != self.path:
+            return
+        self._saved_version = self.store.version if version is None else version
+
     def bboxes2lines(self):
-        lines = []
-        for bbox in self.bboxes:
-            lines.append(bbox.yolo_line() + '\n')
-        return lines
+        return self.bboxes2text().splitlines(keepends=True)
 
     def load_bboxes(self):
+        self.store.clear()
+        self.load_errors = []
         if os.path.exists(self.txtpath()):
-            print(f'Successfully loaded annotations for {self.path}')
-            lines = []
-            self.bboxes = []
-            with open(self.txtpath(), 'r') as txt:
-                lines = txt.readlines()
-            for line in lines:
-                if line != '' and len(line) != 0:
-                    bbox = BBox(self.imgw, self.imgh)
-                    bbox.parse_yolo_line(line)
-                    self.bboxes.append(bbox)
+            log.debug('Loaded annotations for %s', self.path)
+            labels = read_yolo(self.txtpath())
+            self.store.extend(labels.cls, labels.xywh)
+            self.load_errors = labels.errors
+            for e in labels.errors:
+                log.warning('%s:%d: skipped malformed line (%s): %r', self.txtpath(), e.lineno, e.reason, e.line)
         else:
-            print(f'No annotations file found for {self.path}')
+            log.debug('No annotations file found for %s', self.path)
+        self.rebuild_index()
+        self.mark_saved()
+        self._undo.clear()
+        self._redo.clear()
+        self._edit_before = None
+
+    def rebuild_index(self):
+        self.index = GridIndex(max(32, max(self.imgw, self.imgh) // 64))
+        self.index.insert_many(self.store.uids(), self.store.rects())
+
+    def box_moved(self, uid :int):
+        if uid in self.index:
+            self.index.update(uid, self.view_uid(uid).rect())
+
+    def rows_in_rect(self, left, top, right, bottom) -> np.ndarray:
+        # Rows of the boxes touching the rectangle (image pixels), in list order.
+        store = self.store
+        rows = [store.row_of(uid) for uid in self.index.query(left, top, right, bottom)]
+        return np.array(sorted(rows), np.int64)
+
+    def boxes_in_rect(self, left, top, right, bottom) -> list[BBox]:
+        return [self.view(row) for row in self.rows_in_rect(left, top, right, bottom).tolist()]
+
+    def boxes_at(self, x, y, radius=0) -> list[BBox]:
+        return self.boxes_in_rect(x - radius, y - radius, x + radius, y + radius)
 
     def get_lstw_list(self):
-        if len(self.bboxes) == 0:
+        store = self.store
+        if store.n == 0:
             return None
         lst = []
-        for b in self.bboxes:
-            lbl = self.class_id_to_name(b.lbl)
-            s = f'{lbl} {b.left} {b.right} {b.top} {b.bottom}'
+        for lbl, (left, top, right, bottom) in zip(store.cls[:store.n].tolist(), store.rects().tolist()):
+            lbl = self.class_id_to_name(lbl)
+            s = f'{lbl} {left} {right} {top} {bottom}'
             lst.append(s)
         return lst
     
@@ -310,22 +501,18 @@ class Sample(qtc.QObject):
         self.set_selected(bbox)
 
     def get_selected_index(self):
-        i = 0
-        bbox :BBox
-        for bbox in self.bboxes:
-            if bbox._selected:
-                return i
-            i+=1
-        return -1
+        if not self.bbox_selected:
+            return -1
+        return self._selected_bbox.row
 
     def delete_selected(self):
         if not self.bbox_selected:
-            print('No bbox selected.')
+            log.debug('No bbox selected.')
             return
-        i = 0
-        for bbox in self.bboxes:
-            if bbox.selected:
-                break
-            i = i + 1
-        self.bboxes.pop(i)
-        self._selected_bbox = None
\ No newline at end of file
+        bbox = self._selected_bbox
+        record = EditRecord('del', bbox.row, self.store.values(bbox.row), None)
+        self.index.remove(bbox.uid)
+        self.store.delete(bbox.row)
+        self.record_edit(record)
+        self._views.pop(bbox.uid, None)
+        self._selected_bbox = None
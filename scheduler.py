@@ -0,0 +1,66 @@
+import threading
+import time
+import math
+from PyQt6 import QtCore as qtc
+
+
+DIRTY_INPUT = 1
+DIRTY_IMAGE = 2
+DIRTY_BOXES = 4
+DIRTY_VIEWPORT = 8
+DIRTY_ALL = DIRTY_INPUT | DIRTY_IMAGE | DIRTY_BOXES | DIRTY_VIEWPORT
+
+
+class RenderScheduler(qtc.QObject):
+    # Collects dirty flags from any thread and emits at most one sgl_frame per burst,
+    # on the thread the scheduler lives in.
+    sgl_frame = qtc.pyqtSignal(int)
+    _sgl_request = qtc.pyqtSignal()
+
+    def __init__(self, max_fps: float = 60., *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_fps = max_fps  # <= 0 disables the cap
+        self.requests = 0
+        self.frames = 0
+        self._dirty = 0
+        self._pending = False
+        self._lock = threading.Lock()
+        self._last_frame = 0.
+        self._timer = qtc.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._fire)
+        self._sgl_request.connect(self._on_request, type=qtc.Qt.ConnectionType.QueuedConnection)
+
+    def request(self, flags: int = DIRTY_INPUT):
+        with self._lock:
+            self._dirty |= flags
+            self.requests += 1
+            if self._pending:
+                return
+            self._pending = True
+        self._sgl_request.emit()
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @qtc.pyqtSlot()
+    def _on_request(self):
+        if self.max_fps > 0:
+            wait = self._last_frame + 1. / self.max_fps - time.perf_counter()
+            if wait > 0:
+                self._timer.start(math.ceil(wait * 1000))
+                return
+        self._fire()
+
+    @qtc.pyqtSlot()
+    def _fire(self):
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = 0
+            self._pending = False
+        if not dirty:
+            return
+        self._last_frame = time.perf_counter()
+        self.frames += 1
+        self.sgl_frame.emit(dirty)
@@ -0,0 +1,117 @@
+import numpy as np
+
+
+class GridIndex:
+    # Uniform grid over image pixel space. Each key is registered in every cell its
+    # rectangle touches, so a query only has to look at the cells it overlaps.
+
+    def __init__(self, cell: int = 128):
+        self.cell = max(1, int(cell))
+        self._cells: dict[tuple[int, int], set] = {}
+        self._rects: dict = {}
+
+    def __len__(self):
+        return len(self._rects)
+
+    def __contains__(self, key):
+        return key in self._rects
+
+    def _cell_range(self, rect):
+        left, top, right, bottom = rect
+        c = self.cell
+        return int(left // c), int(top // c), int(right // c), int(bottom // c)
+
+    def insert(self, key, rect):
+        rect = (min(rect[0], rect[2]), min(rect[1], rect[3]), max(rect[0], rect[2]), max(rect[1], rect[3]))
+        self._rects[key] = rect
+        cx1, cy1, cx2, cy2 = self._cell_range(rect)
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                self._cells.setdefault((cx, cy), set()).add(key)
+
+    def insert_many(self, keys, rects):
+        # insert() for keys not in the index yet, with the cells of every rectangle worked out
+        # on arrays and grouped with one sort instead of one set update per cell and key.
+        keys = np.asarray(keys).reshape(-1)
+        rects = np.asarray(rects, np.float64).reshape(-1, 4)
+        if not len(keys):
+            return
+        lo = np.minimum(rects[:, :2], rects[:, 2:])
+        hi = np.maximum(rects[:, :2], rects[:, 2:])
+        c = self.cell
+        c1 = (lo // c).astype(np.int64)
+        c2 = (hi // c).astype(np.int64)
+        nx = c2[:, 0] - c1[:, 0] + 1
+        counts = nx * (c2[:, 1] - c1[:, 1] + 1)
+        # One entry per (key, cell) pair.
+        owner = np.repeat(np.arange(len(keys)), counts)
+        local = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = c1[owner, 0] + local % nx[owner]
+        cy = c1[owner, 1] + local // nx[owner]
+        x0 = cx.min()
+        cell_ids = (cy - cy.min()) * (cx.max() - x0 + 1) + (cx - x0)
+        order = np.argsort(cell_ids, kind='stable')
+        _, starts = np.unique(cell_ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        members = keys[owner[order]].tolist()
+        groups = zip(zip(cx[order[starts]].tolist(), cy[order[starts]].tolist()),
+                     map(set, map(members.__getitem__, map(slice, starts.tolist(), ends.tolist()))))
+        if not self._cells:
+            self._cells = dict(groups)
+        else:
+            for cell, group in groups:
+                existing = self._cells.get(cell)
+                if existing is None:
+                    self._cells[cell] = group
+                else:
+                    existing |= group
+        self._rects.update(zip(keys.tolist(), zip(*np.concatenate([lo, hi], axis=1).T.tolist())))
+
+    def remove(self, key):
+        rect = self._rects.pop(key, None)
+        if rect is None:
+            return
+        cx1, cy1, cx2, cy2 = self._cell_range(rect)
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                cell = self._cells.get((cx, cy))
+                if cell is None:
+                    continue
+                cell.discard(key)
+                if not cell:
+                    del self._cells[(cx, cy)]
+
+    def update(self, key, rect):
+        old = self._rects.get(key)
+        if old is not None and self._cell_range(old) == self._cell_range(rect):
+            self._rects[key] = (min(rect[0], rect[2]), min(rect[1], rect[3]), max(rect[0], rect[2]), max(rect[1], rect[3]))
+            return
+        self.remove(key)
+        self.insert(key, rect)
+
+    def clear(self):
+        self._cells.clear()
+        self._rects.clear()
+
+    def query(self, left, top, right, bottom) -> set:
+        cx1, cy1, cx2, cy2 = self._cell_range((left, top, right, bottom))
+        candidates = set()
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self._cells):
+            for cell in self._cells.values():
+                candidates |= cell
+        else:
+            for cy in range(cy1, cy2 + 1):
+                for cx in range(cx1, cx2 + 1):
+                    cell = self._cells.get((cx, cy))
+                    if cell is not None:
+                        candidates |= cell
+        rects = self._rects
+        hits = set()
+        for key in candidates:
+            l, t, r, b = rects[key]
+            if l <= right and r >= left and t <= bottom and b >= top:
+                hits.add(key)
+        return hits
+
+    def query_point(self, x, y, radius=0) -> set:
+        return self.query(x - radius, y - radius, x + radius, y + radius)
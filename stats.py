@@ -0,0 +1,221 @@
+import math
+import os
+import threading
+import numpy as np
+from PyQt6 import QtCore as qtc
+from PyQt6 import QtGui as qtg
+from PyQt6 import QtWidgets as qtw
+from datasetindex import label_stem
+from yolo import read_yolo
+
+
+# Box size is sqrt(w * h) relative to the image, aspect is log2 of the pixel width/height ratio.
+SIZE_EDGES = np.array([1 / 64, 1 / 32, 1 / 16, 1 / 8, 1 / 4, 1 / 2])
+SIZE_LABELS = ('< 1/64', '1/64-1/32', '1/32-1/16', '1/16-1/8', '1/8-1/4', '1/4-1/2', '>= 1/2')
+ASPECT_EDGES = np.array([-2., -1., -0.5, 0.5, 1., 2.])
+ASPECT_LABELS = ('< 1:4', '1:4-1:2', '1:2-1:1.4', '~1:1', '1.4:1-2:1', '2:1-4:1', '> 4:1')
+
+
+def box_bins(cls, xywh, imgw: int, imgh: int) -> np.ndarray:
+    # (n, 3) int32 rows of class id, size bin and aspect bin: all an image contributes.
+    xywh = np.asarray(xywh, np.float64).reshape(-1, 4)
+    w = xywh[:, 2]
+    h = xywh[:, 3]
+    size = np.sqrt(np.maximum(w * h, 0.))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect = np.log2((w * (imgw or 1)) / (h * (imgh or 1)))
+    aspect = np.nan_to_num(aspect, nan=0., posinf=10., neginf=-10.)
+    return np.column_stack([np.asarray(cls, np.int32).reshape(-1),
+                            np.searchsorted(SIZE_EDGES, size, side='right'),
+                            np.searchsorted(ASPECT_EDGES, aspect, side='right')]).astype(np.int32)
+
+
+class DatasetStats(qtc.QObject):
+    # Totals for a dataset, kept as the sum of per-image contributions so that an edit or save
+    # only subtracts that image's old bins and adds its new ones. The first full pass over the
+    # label files runs on a background thread.
+    sgl_changed = qtc.pyqtSignal()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.reset()
+
+    def reset(self, images: int = 0):
+        with self._lock:
+            self._generation += 1
+            self.images = images
+            self.boxes_per_class = np.zeros(0, np.int64)
+            self.images_per_class = np.zeros(0, np.int64)
+            self.size_hist = np.zeros(len(SIZE_LABELS), np.int64)
+            self.aspect_hist = np.zeros(len(ASPECT_LABELS), np.int64)
+            self.labelled = 0
+            self.loading = False
+            self._loads = 0
+            self._per_image: dict[str, np.ndarray] = {}
+            self._touched = set()  # images updated live while the background pass runs
+        self.sgl_changed.emit()
+
+    def _grow(self, ncls: int):
+        if ncls > len(self.boxes_per_class):
+            self.boxes_per_class = np.pad(self.boxes_per_class, (0, ncls - len(self.boxes_per_class)))
+            self.images_per_class = np.pad(self.images_per_class, (0, ncls - len(self.images_per_class)))
+
+    def _apply(self, bins: np.ndarray, sign: int):
+        if len(bins) == 0:
+            return
+        cls = bins[:, 0]
+        cls = cls[cls >= 0]
+        if len(cls):
+            counts = np.bincount(cls)
+            self._grow(len(counts))
+            self.boxes_per_class[:len(counts)] += sign * counts
+            self.images_per_class[:len(counts)] += sign * (counts > 0)
+        self.size_hist += sign * np.bincount(bins[:, 1], minlength=len(SIZE_LABELS))
+        self.aspect_hist += sign * np.bincount(bins[:, 2], minlength=len(ASPECT_LABELS))
+        self.labelled += sign
+
+    def _set(self, name: str, bins: np.ndarray):
+        old = self._per_image.pop(name, None)
+        if old is not None:
+            self._apply(old, -1)
+        if len(bins):
+            self._per_image[name] = bins
+            self._apply(bins, 1)
+
+    def set_image(self, name: str, cls, xywh, imgw: int, imgh: int):
+        # Replaces one image's contribution, O(boxes in that image).
+        bins = box_bins(cls, xywh, imgw, imgh)
+        with self._lock:
+            if self.loading:
+                self._touched.add(name)
+            self._set(name, bins)
+        self.sgl_changed.emit()
+
+    def add_images(self, count: int):
+        with self._lock:
+            self.images += count
+        self.sgl_changed.emit()
+
+    def load(self, directory: str, rows: list[tuple]):
+        # rows are DatasetIndex rows; only images the index says have boxes are read.
+        with self._lock:
+            generation = self._generation
+            self._loads += 1
+            self.loading = True
+        thread = threading.Thread(target=self._load, args=(directory, rows, generation), name='stats', daemon=True)
+        thread.start()
+        return thread
+
+    def _load(self, directory: str, rows: list[tuple], generation: int, chunk: int = 2048):
+        rows = [row for row in rows if row[6]]
+        for start in range(0, len(rows), chunk):
+            loaded = []
+            for name, _, _, width, height, _, _ in rows[start:start + chunk]:
+                try:
+                    labels = read_yolo(os.path.join(directory, label_stem(name) + '.txt'))
+                except OSError:
+                    continue
+                loaded.append((name, box_bins(labels.cls, labels.xywh, width, height)))
+            with self._lock:
+                if generation != self._generation:
+                    return
+                for name, bins in loaded:
+                    if name not in self._touched:
+                        self._set(name, bins)
+            self.sgl_changed.emit()
+        with self._lock:
+            if generation == self._generation:
+                self._loads -= 1
+                if not self._loads:
+                    self.loading = False
+                    self._touched.clear()
+        self.sgl_changed.emit()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'images': self.images,
+                'labelled': self.labelled,
+                'unlabelled': max(0, self.images - self.labelled),
+                'boxes_per_class': self.boxes_per_class.copy(),
+                'images_per_class': self.images_per_class.copy(),
+                'size_hist': self.size_hist.copy(),
+                'aspect_hist': self.aspect_hist.copy(),
+                'loading': self.loading,
+            }
+
+
+class StatsPanel(qtw.QDockWidget):
+    # Redraws at most every refresh_ms however many edits or load chunks arrive.
+
+    def __init__(self, stats: DatasetStats, parent=None, refresh_ms: int = 250):
+        super().__init__('Dataset Stats', parent)
+        self.setObjectName('dock_stats')
+        self.stats = stats
+        self.classes: list[str] = []
+        widget = qtw.QWidget(self)
+        layout = qtw.QVBoxLayout(widget)
+        self.lbl_summary = qtw.QLabel(widget)
+        layout.addWidget(self.lbl_summary)
+        self.tblw_classes = qtw.QTableWidget(0, 3, widget)
+        self.tblw_classes.setHorizontalHeaderLabels(['Class', 'Boxes', 'Images'])
+        self.tblw_classes.setEditTriggers(qtw.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.tblw_classes.verticalHeader().setVisible(False)
+        self.tblw_classes.horizontalHeader().setSectionResizeMode(0, qtw.QHeaderView.ResizeMode.Stretch)
+        layout.addWidget(self.tblw_classes)
+        self.lbl_hist = qtw.QLabel(widget)
+        self.lbl_hist.setFont(qtg.QFontDatabase.systemFont(qtg.QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.lbl_hist)
+        self.setWidget(widget)
+        self._timer = qtc.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(refresh_ms)
+        self._timer.timeout.connect(self.refresh)
+        stats.sgl_changed.connect(self._on_changed)
+
+    def set_classes(self, classes: list[str]):
+        self.classes = list(classes)
+        self._on_changed()
+
+    @qtc.pyqtSlot()
+    def _on_changed(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+    @qtc.pyqtSlot()
+    def refresh(self):
+        if not self.isVisible():
+            return
+        snap = self.stats.snapshot()
+        boxes = snap['boxes_per_class']
+        images = snap['images_per_class']
+        loading = ' (loading...)' if snap['loading'] else ''
+        self.lbl_summary.setText(f"{snap['images']} images, {snap['labelled']} labelled, "
+                                 f"{snap['unlabelled']} unlabelled, {int(boxes.sum())} boxes{loading}")
+        n = max(len(self.classes), len(boxes))
+        self.tblw_classes.setRowCount(n)
+        for i in range(n):
+            name = self.classes[i] if i < len(self.classes) else str(i)
+            values = (name, int(boxes[i]) if i < len(boxes) else 0, int(images[i]) if i < len(images) else 0)
+            for col, value in enumerate(values):
+                item = self.tblw_classes.item(i, col)
+                if item is None:
+                    item = qtw.QTableWidgetItem()
+                    if col:
+                        item.setTextAlignment(qtc.Qt.AlignmentFlag.AlignRight | qtc.Qt.AlignmentFlag.AlignVCenter)
+                    self.tblw_classes.setItem(i, col, item)
+                item.setText(str(value))
+        self.lbl_hist.setText('Box size (sqrt area / image)\n' + self._bars(SIZE_LABELS, snap['size_hist'])
+                              + '\n\nAspect (w:h)\n' + self._bars(ASPECT_LABELS, snap['aspect_hist']))
+
+    @staticmethod
+    def _bars(labels, hist, width: int = 24) -> str:
+        top = max(1, int(hist.max()))
+        return '\n'.join(f'{label:>10} {"#" * math.ceil(width * int(v) / top):<{width}} {int(v)}'
+                         for label, v in zip(labels, hist))
+
+    def showEvent(self, event: qtg.QShowEvent):
+        super().showEvent(event)
+        self.refresh()
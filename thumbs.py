@@ -0,0 +1,277 @@
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import cv2
+import numpy as np
+from PyQt6 import QtCore as qtc
+from PyQt6 import QtGui as qtg
+from datasetindex import INDEX_DIR
+from imagesource import read_image_size
+from regionsource import TIFF_EXTENSIONS, is_large, open_tiff
+
+
+def make_thumbnail(path: str, size: int) -> np.ndarray:
+    # BGR image whose longer side is at most size. JPEGs are decoded at 1/2, 1/4 or 1/8
+    # resolution when that is still at least size, so most of the IDCT work is skipped.
+    flag = cv2.IMREAD_COLOR
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        dims = read_image_size(path)
+    except OSError:
+        dims = None
+    if dims is not None and is_large(*dims) and ext not in ('.jpg', '.jpeg'):
+        # Only the smallest level of a pyramidal TIFF; other large images get no thumbnail.
+        regions = open_tiff(path) if ext in TIFF_EXTENSIONS else None
+        if regions is None or is_large(*regions.levels[-1].shape[1::-1]):
+            return None
+        img = regions.levels[-1][:, :]
+        regions.close()
+    else:
+        if ext in ('.jpg', '.jpeg') and dims is not None:
+            for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                    (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if max(dims) // factor >= size:
+                    flag = reduced
+                    break
+        img = cv2.imread(path, flag)
+        if img is None:
+            return None
+    h, w = img.shape[:2]
+    scale = size / max(h, w)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return img
+
+
+class ThumbnailAtlas:
+    # Fixed-size BGR slots in memory-mapped segment files of capacity slots each,
+    # <dir>/.nardelbl/thumbs-<size>.atlas, then .atlas.1, .atlas.2, ..., with a sqlite table
+    # mapping image name and mtime to a slot. A changed image reuses its slot. A full atlas
+    # gets a new segment rather than a bigger file: Windows cannot resize a mapped file, and
+    # views handed out earlier keep their mapping alive.
+    def __init__(self, directory: str, size: int = 96, capacity: int = 256):
+        self.size = size
+        self.capacity = capacity
+        base = os.path.join(directory, INDEX_DIR, f'thumbs-{size}')
+        self._lock = threading.Lock()
+        self._puts = 0
+        try:
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            self._db = sqlite3.connect(base + '.sqlite', check_same_thread=False)
+            self.path = base + '.atlas'
+        except (OSError, sqlite3.Error):
+            # Read-only dataset: thumbnails live in memory for this session.
+            self._db = sqlite3.connect(':memory:', check_same_thread=False)
+            self.path = None
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS thumbs ('
+                         'name TEXT PRIMARY KEY, mtime_ns INTEGER, slot INTEGER, width INTEGER, height INTEGER)')
+        # Slots whose segment file is missing (deleted, or an atlas written as one growing file)
+        # are forgotten and made again.
+        segments = 0
+        while self.path is not None and os.path.exists(self._segment_path(segments)):
+            segments += 1
+        self._db.execute('DELETE FROM thumbs WHERE slot >= ?', (segments * capacity,))
+        (last,) = self._db.execute('SELECT MAX(slot) FROM thumbs').fetchone()
+        self._next_slot = 0 if last is None else last + 1
+        self._slots = {name: (mtime_ns, slot, w, h) for name, mtime_ns, slot, w, h in
+                       self._db.execute('SELECT * FROM thumbs')}
+        self._segments: list[np.ndarray] = []
+        while len(self._segments) * capacity <= max(self._next_slot - 1, 0):
+            self._segments.append(self._map_segment(len(self._segments)))
+
+    @property
+    def slot_bytes(self):
+        return self.size * self.size * 3
+
+    def _segment_path(self, i: int) -> str:
+        return self.path if i == 0 else f'{self.path}.{i}'
+
+    def _map_segment(self, i: int) -> np.ndarray:
+        shape = (self.capacity, self.size, self.size, 3)
+        if self.path is None:
+            return np.zeros(shape, np.uint8)
+        path = self._segment_path(i)
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        with open(path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self.capacity * self.slot_bytes:
+                f.truncate(self.capacity * self.slot_bytes)  # not mapped yet, so safe everywhere
+        return np.memmap(path, np.uint8, 'r+', shape=shape)
+
+    def _view(self, slot: int, w: int, h: int) -> np.ndarray:
+        return self._segments[slot // self.capacity][slot % self.capacity, :h, :w]
+
+    def get(self, name: str, mtime_ns: int) -> np.ndarray:
+        with self._lock:
+            entry = self._slots.get(name)
+            if entry is None or entry[0] != mtime_ns:
+                return None
+            _, slot, w, h = entry
+            return self._view(slot, w, h)
+
+    def put(self, name: str, mtime_ns: int, img: np.ndarray) -> np.ndarray:
+        h, w = img.shape[:2]
+        with self._lock:
+            entry = self._slots.get(name)
+            if entry is not None:
+                slot = entry[1]
+            else:
+                slot = self._next_slot
+                if slot // self.capacity >= len(self._segments):
+                    self._segments.append(self._map_segment(len(self._segments)))
+                self._next_slot += 1  # only once the slot is mapped
+            self._view(slot, w, h)[:] = img
+            self._slots[name] = (mtime_ns, slot, w, h)
+            self._db.execute('INSERT OR REPLACE INTO thumbs VALUES (?, ?, ?, ?, ?)', (name, mtime_ns, slot, w, h))
+            self._puts += 1
+            if self._puts % 64 == 0:
+                self._db.commit()
+            return self._view(slot, w, h)
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                if isinstance(segment, np.memmap):
+                    segment.flush()
+            self._db.commit()
+            self._db.close()
+
+
+class ThumbnailLoader(qtc.QObject):
+    # Background pool that fills the atlas. Requests are served newest first and the oldest are
+    # dropped past max_pending, so fast scrolling only decodes what is on screen now.
+    sgl_ready = qtc.pyqtSignal(int)  # file index
+
+    def __init__(self, workers: int = 3, max_pending: int = 256, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_pending = max_pending
+        self.atlas: ThumbnailAtlas = None
+        self._pending: OrderedDict = OrderedDict()  # file index -> (path, name, mtime_ns)
+        self._busy = set()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._run, name=f'thumbs-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def set_atlas(self, atlas: ThumbnailAtlas):
+        with self._cond:
+            self._pending.clear()
+            old = self.atlas
+            self.atlas = atlas
+        if old is not None:
+            old.close()
+
+    def request(self, filei: int, path: str, name: str, mtime_ns: int):
+        with self._cond:
+            if filei in self._busy:
+                return
+            self._pending[filei] = (path, name, mtime_ns)
+            self._pending.move_to_end(filei)
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if self._closed:
+                    return
+                filei, (path, name, mtime_ns) = self._pending.popitem(last=True)
+                self._busy.add(filei)
+                atlas = self.atlas
+            try:
+                img = make_thumbnail(path, atlas.size) if atlas is not None else None
+                if img is not None:
+                    with self._cond:
+                        current = atlas is self.atlas
+                    if current:
+                        atlas.put(name, mtime_ns, img)
+                        self.sgl_ready.emit(filei)
+            except (OSError, sqlite3.Error, cv2.error):
+                pass
+            finally:
+                with self._cond:
+                    self._busy.discard(filei)
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+        if self.atlas is not None:
+            for thread in self._threads:
+                thread.join(1.)
+            self.atlas.close()
+
+
+class ThumbnailModel(qtc.QIdentityProxyModel):
+    # FileListModel plus a DecorationRole, so the grid shares the list's sorting and filtering.
+    # Pixmaps come from the atlas and are kept in a small LRU; missing ones are requested from
+    # the loader and shown as a placeholder until sgl_ready arrives.
+
+    def __init__(self, loader: ThumbnailLoader, path_of, cache_size: int = 512, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loader = loader
+        self.path_of = path_of  # file index -> image path
+        self.cache_size = cache_size
+        self._pixmaps: OrderedDict = OrderedDict()
+        self._placeholder: qtg.QPixmap = None
+        loader.sgl_ready.connect(self._on_ready)
+
+    def clear(self):
+        self._pixmaps.clear()
+
+    def thumbnail_size(self) -> int:
+        return self.loader.atlas.size if self.loader.atlas is not None else 96
+
+    def data(self, index: qtc.QModelIndex, role: int = qtc.Qt.ItemDataRole.DisplayRole):
+        if role != qtc.Qt.ItemDataRole.DecorationRole:
+            return super().data(index, role)
+        if not index.isValid():
+            return None
+        source = self.sourceModel()
+        filei = source.file_index(index.row())
+        pixmap = self._pixmaps.get(filei)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(filei)
+            return pixmap
+        atlas = self.loader.atlas
+        if atlas is None:
+            return self.placeholder()
+        name = source.name(filei)
+        mtime_ns = source.mtime(filei)
+        img = atlas.get(name, mtime_ns)
+        if img is None:
+            self.loader.request(filei, self.path_of(filei), name, mtime_ns)
+            return self.placeholder()
+        img = np.ascontiguousarray(img)
+        qimg = qtg.QImage(img.data, img.shape[1], img.shape[0], img.strides[0], qtg.QImage.Format.Format_BGR888)
+        pixmap = qtg.QPixmap.fromImage(qimg)
+        self._pixmaps[filei] = pixmap
+        while len(self._pixmaps) > self.cache_size:
+            self._pixmaps.popitem(last=False)
+        return pixmap
+
+    def placeholder(self) -> qtg.QPixmap:
+        size = self.thumbnail_size()
+        if self._placeholder is None or self._placeholder.width() != size:
+            self._placeholder = qtg.QPixmap(size, size)
+            self._placeholder.fill(qtg.QColor(64, 64, 64))
+        return self._placeholder
+
+    @qtc.pyqtSlot(int)
+    def _on_ready(self, filei: int):
+        source = self.sourceModel()
+        if source is None:
+            return
+        row = source.row_of(filei)
+        if row < 0:
+            return
+        self._pixmaps.pop(filei, None)
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index, [qtc.Qt.ItemDataRole.DecorationRole])
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+import threading
+import math
+import cv2
+import numpy as np
+from pyramid import ImagePyramid
+
+
+class TileCache:
+    # LRU of rendered tiles bounded by their total size in bytes.
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, key) -> np.ndarray:
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key, tile: np.ndarray):
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._tiles[key] = tile
+            self.nbytes += tile.nbytes
+            while self.nbytes > self.max_bytes and len(self._tiles) > 1:
+                _, evicted = self._tiles.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def discard(self, image_key):
+        with self._lock:
+            for key in [k for k in self._tiles if k[0] == image_key]:
+                self.nbytes -= self._tiles.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {
+            'tiles': len(self._tiles),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class TileRenderer:
+    # Tiles live in display space: tile (tx, ty) covers display pixels
+    # [tx * tile_size, (tx + 1) * tile_size) of the whole image scaled by the slider scale,
+    # so panning at a fixed scale only renders the tiles that scroll into view.
+    PLACEHOLDER = 64  # grey drawn where the only level to sample would have to be read from file
+
+    def __init__(self, cache: TileCache, tile_size: int = 256):
+        self.cache = cache
+        self.tile_size = tile_size
+
+    def render(self, image_key, pyramid: ImagePyramid, transform: tuple[int, int, int, int, int, int, float],
+               out: np.ndarray = None, fast: bool = False) -> np.ndarray:
+        # fast renders missing tiles with nearest-neighbour sampling for frames drawn while the
+        # user zooms or pans; a finished tile of the same view is still used when cached.
+        scaled_h, scaled_w, y1, y2, x1, x2, scale = transform
+        k = pyramid.level_for_scale(scale)
+        level = pyramid.levels[k]
+        src = pyramid.src
+        ax = level.shape[1] / src.shape[1] / scale  # level pixels per display pixel
+        ay = level.shape[0] / src.shape[0] / scale
+        T = self.tile_size
+        if out is None:
+            out = np.empty((y2 - y1, x2 - x1) + level.shape[2:], level.dtype)
+        if (ax > 2 or ay > 2) and not isinstance(level, np.ndarray):
+            # Zoomed out past a level read by region (a TiffLevel) before the pyramid has a
+            # smaller one: the view would decode most of the file every frame. Nothing is
+            # cached, the frame after pyramid.on_ready draws the image.
+            out.fill(self.PLACEHOLDER)
+            return out
+        for ty in range(y1 // T, (y2 - 1) // T + 1):
+            for tx in range(x1 // T, (x2 - 1) // T + 1):
+                key = (image_key, k, scale, tx, ty, False)
+                tile = self.cache.get(key)
+                if tile is None and fast:
+                    key = (image_key, k, scale, tx, ty, True)
+                    tile = self.cache.get(key)
+                ox = tx * T
+                oy = ty * T
+                if tile is None:
+                    tw = min(T, scaled_w - ox)
+                    th = min(T, scaled_h - oy)
+                    tile = self._render_tile(level, ax, ay, ox, oy, tw, th, fast)
+                    self.cache.put(key, tile)
+                cx1 = max(x1, ox)
+                cy1 = max(y1, oy)
+                cx2 = min(x2, ox + tile.shape[1])
+                cy2 = min(y2, oy + tile.shape[0])
+                out[cy1 - y1:cy2 - y1, cx1 - x1:cx2 - x1] = tile[cy1 - oy:cy2 - oy, cx1 - ox:cx2 - ox]
+        return out
+
+    @staticmethod
+    def _render_tile(level: np.ndarray, ax: float, ay: float, ox: int, oy: int, tw: int, th: int,
+                     fast: bool = False) -> np.ndarray:
+        # Every tile samples the same global display->level mapping, so neighbouring tiles
+        # line up without seams. Only a small margin around the tile is handed to warpAffine.
+        lh, lw = level.shape[:2]
+        lx0 = min(lw - 1, max(0, int(ox * ax) - 1))
+        ly0 = min(lh - 1, max(0, int(oy * ay) - 1))
+        lx1 = min(lw, math.ceil((ox + tw) * ax) + 2)
+        ly1 = min(lh, math.ceil((oy + th) * ay) + 2)
+        region = level[ly0:ly1, lx0:lx1]
+        if fast:
+            interpolation = cv2.INTER_NEAREST
+            n = 1
+        else:
+            # Downscaling: sample an n times finer grid and average each n x n block with
+            # INTER_AREA, which lines up exactly with the display pixels of the tile.
+            interpolation = cv2.INTER_LINEAR
+            n = min(4, math.ceil(max(ax, ay) - 1e-6))
+        bx, by = ax / n, ay / n  # level pixels per sample
+        M = np.float32([
+            [bx, 0, (ox * n + .5) * bx - .5 - lx0],
+            [0, by, (oy * n + .5) * by - .5 - ly0],
+        ])
+        flags = interpolation | cv2.WARP_INVERSE_MAP
+        tile = cv2.warpAffine(region, M, (tw * n, th * n), flags=flags, borderMode=cv2.BORDER_REPLICATE)
+        if n > 1:
+            tile = cv2.resize(tile, (tw, th), interpolation=cv2.INTER_AREA)
+        return tile
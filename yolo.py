@@ -0,0 +1,188 @@
+from collections import namedtuple
+from itertools import repeat
+import math
+import warnings
+import numpy as np
+
+
+LabelError = namedtuple('LabelError', ['lineno', 'line', 'reason'])
+YoloLabels = namedtuple('YoloLabels', ['cls', 'xywh', 'linenos', 'errors'])
+
+
+def parse_yolo(text: str) -> YoloLabels:
+    # Whole-file parse. Well-formed files go through a single C-level float parse;
+    # anything else falls back to a per-line pass that reports each bad line instead of raising.
+    lines = text.splitlines()
+    linenos = _row_linenos(text, lines)
+    if linenos is None:
+        return _parse_lines(lines)
+    if not len(linenos):
+        return _empty()
+    values = _parse_all(text, len(linenos))
+    if values is not None:
+        cls = values[:, 0]
+        if np.isfinite(values).all() and np.all(cls == np.floor(cls)):
+            return YoloLabels(cls.astype(np.int32), values[:, 1:].copy(), linenos, [])
+    return _parse_lines(lines)
+
+
+def _row_linenos(text: str, lines: list[str]) -> np.ndarray:
+    # Numbers of the non-blank lines, None when one of them cannot be a 5-value row.
+    if not text.isascii() or any(c in text for c in '\t\v\f\x1c\x1d\x1e\x1f'):
+        counts = np.fromiter(map(len, map(str.split, lines)), np.int64, len(lines))
+        if not np.isin(counts, (0, 5)).all():
+            return None
+        return np.flatnonzero(counts) + 1
+    # Only spaces separate values here, so a line with 4 of them holds at most 5 values, and
+    # _parse_all() finding 5 per row means every row has exactly 5.
+    rows = np.fromiter(map(str.count, lines, repeat(' ')), np.int64, len(lines)) == 4
+    if np.count_nonzero(rows) + lines.count('') != len(lines):
+        return None
+    return np.flatnonzero(rows) + 1
+
+
+def _empty() -> YoloLabels:
+    return YoloLabels(np.zeros(0, np.int32), np.zeros((0, 4), np.float64), np.zeros(0, np.int64), [])
+
+
+def _parse_all(text: str, nrows: int) -> np.ndarray:
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        try:
+            values = np.fromstring(text, dtype=np.float64, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+    if values.size != nrows * 5:
+        return None
+    return values.reshape(nrows, 5)
+
+
+def _parse_lines(lines: list[str]) -> YoloLabels:
+    cls = []
+    xywh = []
+    linenos = []
+    errors = []
+    for lineno, line in enumerate(lines, 1):
+        s = line.split()
+        if not s:
+            continue
+        if len(s) != 5:
+            errors.append(LabelError(lineno, line, f'expected 5 values, got {len(s)}'))
+            continue
+        lbl = _parse_class_id(s[0])
+        if lbl is None:
+            errors.append(LabelError(lineno, line, f'class id {s[0]!r} is not an integer'))
+            continue
+        try:
+            coords = [float(v) for v in s[1:]]
+        except ValueError:
+            errors.append(LabelError(lineno, line, 'coordinate is not a number'))
+            continue
+        if not all(math.isfinite(v) for v in coords):
+            errors.append(LabelError(lineno, line, 'coordinate is not finite'))
+            continue
+        cls.append(lbl)
+        xywh.append(coords)
+        linenos.append(lineno)
+    if not cls:
+        return YoloLabels(*_empty()[:3], errors)
+    return YoloLabels(np.array(cls, np.int32), np.array(xywh, np.float64), np.array(linenos, np.int64), errors)
+
+
+def _parse_class_id(s: str) -> int:
+    # '3' and '3.0' are both accepted, matching the whole-file fast path.
+    try:
+        return int(s)
+    except ValueError:
+        pass
+    try:
+        v = float(s)
+    except ValueError:
+        return None
+    if not v.is_integer():
+        return None
+    return int(v)
+
+
+def read_yolo(path: str) -> YoloLabels:
+    with open(path, 'r', errors='replace') as txt:
+        return parse_yolo(txt.read())
+
+
+def load_classes(path: str) -> list[str]:
+    # classes.txt: one name per non-blank line, class id = position.
+    with open(path, 'r') as txt:
+        return [line.strip() for line in txt if line.strip()]
+
+
+_DEC = 8  # most decimals of a coordinate written without repr()
+_INT = 6  # most integer digits, even
+_PAIRS = np.array([[48 + i // 10, 48 + i % 10] for i in range(100)], np.uint8)  # b'00'..b'99'
+
+
+def format_yolo(cls, xywh) -> str:
+    # repr() gives the shortest string that round-trips, the same text the per-box
+    # f-strings produced, so loading and saving an untouched file leaves it byte-identical.
+    # Coordinates with at most _DEC decimals (anything read from a label file) are written
+    # into a byte matrix in one pass; other rows go through repr().
+    cls = np.asarray(cls).astype(np.int64).ravel()
+    v = np.asarray(xywh, np.float64).reshape(-1, 4)
+    n = len(v)
+    if n == 0:
+        return ''
+    a = np.abs(v)
+    with np.errstate(invalid='ignore', over='ignore'):
+        k = np.rint(a * 10. ** _DEC)
+        # repr() writes these as the decimal k / 10**_DEC without its trailing zeros.
+        exact = (k / 10. ** _DEC == a) & (a < 10. ** _INT) & ((a >= 1e-4) | (a == 0)) & ~(np.signbit(v) & (a == 0))
+    exact = exact.all(1) & (cls >= 0) & (cls < 10 ** 8)
+    k = np.where(exact[:, None], k, 0).astype(np.int64)
+    ip = (k // 10 ** _DEC).astype(np.int32)
+    fp = (k - ip * np.int64(10 ** _DEC)).astype(np.int32)
+    last = np.full(fp.shape, _DEC - 1, np.int32)  # index of the last decimal kept
+    for i in range(1, _DEC):
+        last -= fp % 10 ** i == 0
+    dec = int(last.max()) + 1
+    frac = _digits(fp, _DEC, lead=True)[..., :dec]
+    frac *= np.arange(dec) <= last[..., None]
+    iw = len(str(int(ip.max())))
+    iw += iw % 2
+    cw = len(str(int(cls[exact].max()))) if exact.any() else 1
+    cw += cw % 2
+    neg = int((v < 0).any())
+    w = neg + iw + 1 + dec + 1
+    # One row per box, NUL bytes where a number is shorter than its column.
+    rows = np.zeros((n, cw + 1 + 4 * w), np.uint8)
+    rows[:, :cw] = _digits(np.where(exact, cls, 0), cw)
+    rows[:, cw] = 32
+    fields = rows[:, cw + 1:].reshape(n, 4, w)
+    if neg:
+        fields[..., 0] = np.where(v < 0, 45, 0)
+    fields[..., neg:neg + iw] = _digits(ip, iw)
+    fields[..., neg + iw] = 46
+    fields[..., neg + iw + 1:-1] = frac
+    fields[..., -1] = 32
+    fields[:, 3, -1] = 10
+    text = rows.tobytes().translate(None, b'\0').decode('ascii')
+    if exact.all():
+        return text
+    lines = text.splitlines()
+    for i in np.flatnonzero(~exact).tolist():
+        lines[i] = '%d %r %r %r %r' % (cls[i], *v[i].tolist())
+    return '\n'.join(lines) + '\n'
+
+
+def _digits(a: np.ndarray, width: int, lead: bool = False) -> np.ndarray:
+    # Ints in [0, 10**width) as ASCII digits in a trailing axis of even width. Leading
+    # zeros become NUL bytes unless lead is set.
+    a = a.astype(np.int32)
+    pairs = np.stack([a // 10 ** i % 100 for i in range(width - 2, -1, -2)], -1)
+    out = _PAIRS.take(pairs, 0).reshape(a.shape + (width,))
+    if not lead:
+        out[..., :-1] *= a[..., None] >= 10 ** np.arange(width - 1, 0, -1)
+    return out
+
+
+def write_yolo(path: str, cls, xywh):
+    with open(path, 'w') as txt:
+        txt.write(format_yolo(cls, xywh))